@@ -28,6 +28,19 @@ getTiledVectorSource = (url) => {
             ox = metadata.origin_x, oy = metadata.origin_y,
             z_min = metadata.z_min, z_max = metadata.z_max
 
+        //attribute table, if the tile features carry only their key as id
+        const attributes = metadata.attribute_table ? await (await fetch(url + metadata.attribute_table)).json() : undefined
+
+        //set the properties of a geojson feature from the attribute table
+        //only the features with an id are in the table: the others have their own properties
+        function setAttributes(feature) {
+            if (feature.id === undefined || feature.id === null || feature.id === "") return
+            const row = attributes.rows[feature.id]
+            if (!row) return
+            attributes.columns.forEach((c, i) => feature.properties[c] = row[i])
+            feature.properties[attributes.key] = feature.id
+        }
+
         //transform geojson geometry coordinate from tile CRS to map CRS
         function transformGeoJSONGeometryCoordinates(geometry, tile, ts, r) {
             function transformCoordinates(coordinates) {
@@ -83,6 +96,7 @@ getTiledVectorSource = (url) => {
 
                             //apply coordinates transformation to features
                             geojson.features.forEach(feature => transformGeoJSONGeometryCoordinates(feature.geometry, tile, ts, r));
+                            if (attributes) geojson.features.forEach(setAttributes)
                             geojson.features.forEach(feature => feature.id = Math.round(1e15 * Math.random()))
 
                             //transform into OL feature
@@ -0,0 +1,46 @@
+import os
+import sys
+import numpy as np
+import shapely
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from tiler import clip_tile_geometries, _clip_tile_geometries_per_feature, resolutionise_tile, sparse_tiles
+
+
+# Check of the vectorised tile clipping against the former clipping with an intersection: the clipped geometries
+# must cover the same points, with the same dimension (a line touching a tile must become a point, not a degenerate
+# line on the tile border), and the same in pixel coordinates.
+# The traces are random walks snapped on the pixel grid, so that many of their vertices and segments lie on the tile edges.
+
+resolution = 10
+tile_size = 256 * resolution
+rng = np.random.default_rng(0)
+
+walks = [np.cumsum(rng.integers(-1, 2, size=(300, 2)) * rng.integers(1, 40, size=(300, 1)), axis=0) * resolution for _ in range(60)]
+geoms = [shapely.LineString(w) for w in walks]
+# along a tile edge, touching a tile at a vertex and at a corner, crossing a tile edge at a vertex, and points
+geoms += [
+    shapely.LineString([(-500, 3 * tile_size), (tile_size, 3 * tile_size), (2 * tile_size, 3 * tile_size), (2 * tile_size + 500, 4 * tile_size)]),
+    shapely.LineString([(-500, 155 * resolution), (0, 155 * resolution), (-500, 154 * resolution)]),
+    shapely.LineString([(-500, tile_size + 500), (500, tile_size - 500)]),
+    shapely.LineString([(-500, 100), (0, 100), (500, 100)]),
+    shapely.Point(tile_size, 10 * resolution), shapely.Point(tile_size + 5, tile_size)
+]
+geoms = np.array(geoms, dtype=object)
+
+nb = 0
+for ti, tj, iids in sparse_tiles([{ "geometry": g } for g in geoms], tile_size):
+    bounds = (ti * tile_size, tj * tile_size, (ti + 1) * tile_size, (tj + 1) * tile_size)
+    clipped = clip_tile_geometries(geoms[iids], bounds)
+    reference = _clip_tile_geometries_per_feature(geoms[iids], bounds)
+    assert np.array_equal(shapely.is_empty(clipped), shapely.is_empty(reference)), (ti, tj)
+    clipped, reference = clipped[~shapely.is_empty(clipped)], reference[~shapely.is_empty(reference)]
+    assert np.array_equal(shapely.get_dimensions(clipped), shapely.get_dimensions(reference)), (ti, tj, clipped, reference)
+    assert (shapely.hausdorff_distance(clipped, reference) < 1e-6 * tile_size).all(), (ti, tj)
+
+    # in pixel coordinates
+    clipped, reference = resolutionise_tile(bounds[0], bounds[1], clipped, resolution), resolutionise_tile(bounds[0], bounds[1], reference, resolution)
+    assert (shapely.hausdorff_distance(clipped, reference) == 0).all(), (ti, tj)
+    nb += len(iids)
+
+print(nb, "clippings")
+print("Tile clipping: OK")
@@ -0,0 +1,39 @@
+import os
+import sys
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from fit_reader import read_fit_records, _read_fit_records_fast, _read_fit_records_fitparse, UnsupportedFitFile
+
+
+# Check of the fast FIT reader against fitparse, on the files of the 'fit' folder (see make_fit_corpus.py).
+# The timestamps, latitudes and longitudes of the record messages must be the same, value by value.
+# The files which the fast reader does not support must be read the same way with the fitparse fallback.
+
+FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fit")
+
+# the files read with the fitparse fallback
+FALLBACK = { "compressed.fit", "chained.fit" }
+
+
+for file in sorted(os.listdir(FOLDER)):
+    path = os.path.join(FOLDER, file)
+    with open(path, "rb") as f: data = f.read()
+    reference = _read_fit_records_fitparse(data)
+
+    try:
+        fast = _read_fit_records_fast(data)
+        assert file not in FALLBACK, file + ": expected to be read with fitparse"
+        for field, a, b in zip(["timestamp", "position_lat", "position_long"], fast, reference):
+            assert len(a) == len(b), (file, field, len(a), len(b))
+            assert np.array_equal(a, b, equal_nan=True), (file, field, np.flatnonzero(~((a == b) | (np.isnan(a) & np.isnan(b))))[:10])
+    except UnsupportedFitFile as e:
+        assert file in FALLBACK, file + ": " + str(e)
+
+    # the converted values, as returned to the callers
+    time, lat, lon = read_fit_records(path)
+    assert len(time) == len(reference[0]), file
+    assert np.array_equal(np.isnat(time), np.isnan(reference[0])), file
+    assert np.array_equal(lat, reference[1] * (180 / 2**31), equal_nan=True) and np.array_equal(lon, reference[2] * (180 / 2**31), equal_nan=True), file
+    print(file, len(time), "records, fitparse fallback" if file in FALLBACK else "records")
+
+print("FIT reader: OK")
@@ -0,0 +1,44 @@
+import os
+import sys
+import shapely
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from generalisation import network_generalise
+
+
+# Check of the network generalisation: coincident traces must be merged into edges with higher counts,
+# whatever the positions of their vertices.
+
+def trace(coords, start_time="2024-01-01 10:00:00", end_time="2024-01-01 11:00:00", speed_kmh=10):
+    return { "geometry": shapely.LineString(coords), "start_time": start_time, "end_time": end_time, "speed_kmh": speed_kmh }
+
+
+def counts(fs):
+    # the length of the network by count, and its number of points
+    lengths = {}
+    for f in fs:
+        if f["geometry"].geom_type == "Point": continue
+        lengths[f["count"]] = lengths.get(f["count"], 0) + f["geometry"].length
+    return lengths, sum(1 for f in fs if f["geometry"].geom_type == "Point")
+
+
+# a trace overlapping the middle of another one, without common vertex
+fs = network_generalise([trace([(0,0), (10000,0)]), trace([(2000,0), (8000,0)], "2024-02-01 10:00:00", "2024-02-01 11:00:00", 20)], 500)
+assert counts(fs) == ({ 1: 4000, 2: 6000 }, 0), counts(fs)
+shared = [f for f in fs if f["count"] == 2][0]
+assert shared["first_time"] == "2024-01-01 10:00:00" and shared["last_time"] == "2024-02-01 11:00:00" and shared["speed_kmh"] == 15, shared
+
+# diagonal traces, in opposite directions
+fs = network_generalise([trace([(0,0), (10000,3000)]), trace([(5000,1500), (0,0), (0,5000)])], 500)
+lengths, nb = counts(fs)
+assert abs(lengths[2] - shapely.LineString([(0,0), (5000,1500)]).length) < 1e-6 and nb == 0, lengths
+
+# repeated traces
+fs = network_generalise([trace([(0,0), (3000,4000), (9000,4000)])] * 3, 500)
+assert counts(fs) == ({ 3: 11000 }, 0), counts(fs)
+
+# traces without line, or without point
+assert counts(network_generalise([trace([(0,0), (100,0)]), trace([(0,0), (0,100)])], 500)) == ({}, 1)
+assert counts(network_generalise([trace([(0,0), (1000,0)])], 500)) == ({ 1: 1000 }, 0)
+assert network_generalise([], 500) == []
+
+print("Network generalisation: OK")
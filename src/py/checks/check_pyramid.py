@@ -0,0 +1,59 @@
+import os
+import sys
+import json
+import tempfile
+import shapely
+import geopandas as gpd
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from tiler import tile
+
+
+# Check of the pyramid tiling with an attribute table, on partly keyed features: the features without key
+# must keep their properties and have no id, at all zoom levels, and the other ones must be joined with the table.
+
+def lines_and_points(folder):
+    # some lines and points, half of them without identifier, around the tiling origin
+    lines = [shapely.LineString([(-301234 + 50000 * i, -201234), (-251234 + 50000 * i, 148766 + 20000 * i), (98766, 298766)]) for i in range(8)]
+    points = [shapely.Point(-151234 + 40000 * i, 60000 * i - 101234) for i in range(4)]
+    path = os.path.join(folder, "traces.gpkg")
+    for layer, geoms in [("linestring", lines), ("point", points)]:
+        identifiers = [None if i % 2 else layer + str(i) for i in range(len(geoms))]
+        gdf = gpd.GeoDataFrame({ "identifier": identifiers, "length_m": [float(g.length) for g in geoms] }, geometry=geoms, crs="EPSG:3857")
+        gdf.to_file(path, layer=layer, driver="GPKG")
+    return path
+
+
+def load_tiles(folder):
+    tiles = {}
+    for root, _, files in os.walk(folder):
+        for file in files:
+            if not file.endswith(".geojson"): continue
+            with open(os.path.join(root, file)) as f: tiles[os.path.relpath(os.path.join(root, file), folder)] = json.load(f)
+    return tiles
+
+
+with tempfile.TemporaryDirectory() as folder:
+    path = lines_and_points(folder)
+    for pyramid in [False, True]:
+        output = os.path.join(folder, "pyramid" if pyramid else "tiles") + "/"
+        tile(lambda z: path, output, z_min=3, z_max=7, pyramid=pyramid, attribute_key="identifier")
+        with open(os.path.join(output, "attributes.json")) as f: rows = json.load(f)["rows"]
+        assert sorted(rows) == ["linestring0", "linestring2", "linestring4", "linestring6", "point0", "point2"], sorted(rows)
+
+        tiles = load_tiles(output)
+        keyed = [f for t in tiles.values() for f in t["features"] if "id" in f]
+        unkeyed = [f for t in tiles.values() for f in t["features"] if "id" not in f]
+        assert all(f["id"] in rows and f["properties"] == {} for f in keyed)
+        assert len(unkeyed) > 0 and all(f["properties"]["identifier"] is None and "length_m" in f["properties"] for f in unkeyed)
+
+        # the same tiles, with the same keyed features
+        if not pyramid: reference = tiles
+        else:
+            assert tiles.keys() == reference.keys(), set(tiles.keys()) ^ set(reference.keys())
+            for k in tiles:
+                ids = lambda t: sorted(f["id"] for f in t["features"] if "id" in f)
+                assert ids(tiles[k]) == ids(reference[k]), (k, ids(tiles[k]), ids(reference[k]))
+                has_unkeyed = lambda t: any("id" not in f for f in t["features"])
+                assert has_unkeyed(tiles[k]) == has_unkeyed(reference[k]), k
+
+print("Pyramid tiling: OK")
@@ -0,0 +1,74 @@
+import os
+import sys
+import json
+import tempfile
+import numpy as np
+import shapely
+import geopandas as gpd
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from tiler import tile, decode_tile
+from tile_encoding import encode_binary_tile, decode_binary_tile
+
+
+# Check of the binary tile format: real tiles must be decoded as they were encoded, with their ids, or without id
+# for the features without attribute key, and with their properties of all types.
+# The same tilings are made in GeoJSON and in compressed binary format, and compared tile by tile.
+
+def traces(folder):
+    rng = np.random.default_rng(2)
+    walks = [rng.integers(-200000, 200000, size=2) + np.cumsum(rng.integers(-3000, 3000, size=(100, 2)), axis=0) for _ in range(30)]
+    lines = [shapely.LineString(w) for w in walks]
+    points = [shapely.Point(p) for p in rng.integers(-200000, 200000, size=(10, 2))]
+    path = os.path.join(folder, "traces.gpkg")
+    for layer, geoms in [("linestring", lines), ("point", points)]:
+        n = len(geoms)
+        gdf = gpd.GeoDataFrame({
+            "identifier": [None if i % 3 == 0 else layer + str(i) for i in range(n)],
+            "count": [int(i) - 5 for i in range(n)],
+            "length_m": [float(g.length) + 0.25 for g in geoms],
+            "activity": [None if i % 4 == 0 else "bike é" for i in range(n)],
+            "private": [bool(i % 2) for i in range(n)]
+        }, geometry=geoms, crs="EPSG:3857")
+        gdf.to_file(path, layer=layer, driver="GPKG")
+    return path
+
+
+def tiles(folder, tile_format, compression):
+    out = {}
+    for root, _, files in os.walk(folder):
+        for file in files:
+            if file.endswith(".json"): continue
+            with open(os.path.join(root, file), "rb") as f: out[os.path.relpath(os.path.join(root, file), folder).split(".")[0]] = decode_tile(f.read(), tile_format, compression)
+    return out
+
+
+with tempfile.TemporaryDirectory() as folder:
+    path = traces(folder)
+    nb = 0
+    for attribute_key in [None, "identifier"]:
+        outputs = {}
+        for tile_format, compression in [("geojson", None), ("bin", None), ("bin", "gzip")]:
+            output = os.path.join(folder, str(attribute_key) + tile_format + str(compression)) + "/"
+            tile(lambda z: path, output, z_min=4, z_max=8, tile_format=tile_format, compression=compression, attribute_key=attribute_key)
+            outputs[(tile_format, compression)] = tiles(output, tile_format, compression)
+
+        reference = outputs[("geojson", None)]
+        assert any("id" not in f for t in reference.values() for f in t["features"]) == (attribute_key is not None)
+        for key, output in outputs.items():
+            assert output == reference, (attribute_key, key, [k for k in reference if output.get(k) != reference[k]][:5])
+
+        # round trip of each tile
+        for t in reference.values():
+            assert decode_binary_tile(encode_binary_tile(t)) == t
+            nb += 1
+
+    # properties missing in some features, ids of several types
+    t = { "type":"FeatureCollection", "features": [
+        { "type":"Feature", "id":"12", "properties":{}, "geometry": { "type": "Point", "coordinates": [3, -2] } },
+        { "type":"Feature", "properties":{ "a": 1, "b": None }, "geometry": { "type": "LineString", "coordinates": [[0, 0], [255, 256], [-3, 7]] } },
+        { "type":"Feature", "id":"", "properties":{ "b": "x" }, "geometry": { "type": "MultiLineString", "coordinates": [[[0, 0], [1, 1]], [[5, 5], [6, 4]]] } }
+        ], "crs":{"type":"name","properties":{"name":"urn:ogc:def:crs:EPSG::3857"}} }
+    assert decode_binary_tile(encode_binary_tile(t)) == t, decode_binary_tile(encode_binary_tile(t))
+
+print(nb, "tiles")
+print("Tile encoding: OK")
@@ -0,0 +1,48 @@
+import os
+import sys
+import tempfile
+import filecmp
+import numpy as np
+import shapely
+import geopandas as gpd
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from tiler import tile
+
+
+# Check of the tiling modes: the default, sparse, parallel and out-of-core tilings must write the same tiles,
+# byte for byte. The traces are random walks snapped on the grid of the finest zoom level, on both sides of the
+# tiling origin, so that many of them touch tile edges. The points lie on tile corners and edges.
+
+def traces(folder, resolution):
+    rng = np.random.default_rng(1)
+    walks = [rng.integers(-3000, 3000, size=2) + np.cumsum(rng.integers(-1, 2, size=(200, 2)) * rng.integers(1, 30, size=(200, 1)), axis=0) for _ in range(40)]
+    lines = [shapely.LineString(w * resolution) for w in walks]
+    points = [shapely.Point(x * 256 * resolution, y * 128 * resolution) for x, y in rng.integers(-10, 10, size=(20, 2))]
+    path = os.path.join(folder, "traces.gpkg")
+    for layer, geoms in [("linestring", lines), ("point", points)]:
+        gdf = gpd.GeoDataFrame({ "identifier": [layer + str(i) for i in range(len(geoms))] }, geometry=geoms, crs="EPSG:3857")
+        gdf.to_file(path, layer=layer, driver="GPKG")
+    return path
+
+
+def files(folder):
+    return sorted(os.path.relpath(os.path.join(root, file), folder) for root, _, fs in os.walk(folder) for file in fs)
+
+
+with tempfile.TemporaryDirectory() as folder:
+    path = traces(folder, 250000 / 2**12)
+    modes = { "default": {}, "sparse": dict(sparse=True), "parallel": dict(nb_processes=3), "parallel sparse": dict(sparse=True, nb_processes=3),
+        "out-of-core": dict(memory_budget_mb=0.01, partition_size=2) }
+    outputs = {}
+    for mode, options in modes.items():
+        outputs[mode] = os.path.join(folder, mode.replace(" ", "_")) + "/"
+        tile(lambda z: path, outputs[mode], z_min=9, z_max=12, **options)
+
+    reference = files(outputs["default"])
+    for mode, output in outputs.items():
+        assert files(output) == reference, (mode, set(files(output)) ^ set(reference))
+        different = [f for f in reference if not filecmp.cmp(os.path.join(outputs["default"], f), os.path.join(output, f), shallow=False)]
+        assert len(different) == 0, (mode, different)
+    print(len(reference), "tiles")
+
+print("Tiling modes: OK")
@@ -0,0 +1,105 @@
+import os
+import struct
+import numpy as np
+
+
+# Generation of the small FIT files used by check_fit_reader.py, into the 'fit' folder.
+# The files cover the cases handled by the fast reader of fit_reader.py, and some of the cases where it falls back
+# on fitparse. They are committed: this script is needed only to change them.
+
+FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fit")
+
+# FIT epoch (1989-12-31 00:00:00 UTC), as a unix time
+FIT_EPOCH = 631065600
+
+CRC_TABLE = [0x0000, 0xCC01, 0xD801, 0x1400, 0xF001, 0x3C00, 0x2800, 0xE401, 0xA001, 0x6C00, 0x7800, 0xB401, 0x5000, 0x9C01, 0x8801, 0x4400]
+
+
+def crc(data):
+    c = 0
+    for b in data:
+        tmp = CRC_TABLE[c & 0xF]
+        c = ((c >> 4) & 0x0FFF) ^ tmp ^ CRC_TABLE[b & 0xF]
+        tmp = CRC_TABLE[c & 0xF]
+        c = ((c >> 4) & 0x0FFF) ^ tmp ^ CRC_TABLE[(b >> 4) & 0xF]
+    return c
+
+
+def fit_file(messages, header_size=14):
+    # a FIT file, from its messages
+    body = b"".join(messages)
+    header = struct.pack("<BBHI4s", header_size, 0x10, 2093, len(body), b".FIT")
+    if header_size == 14: header += struct.pack("<H", crc(header))
+    data = header + body
+    return data + struct.pack("<H", crc(data))
+
+
+def definition(local, global_number, fields, big_endian=False, developer_fields=None):
+    # a definition message. The fields are (number, size, base type) triples.
+    h = 0x40 | local | (0x20 if developer_fields else 0)
+    d = bytes([h, 0, 1 if big_endian else 0]) + struct.pack(">H" if big_endian else "<H", global_number) + bytes([len(fields)])
+    d += b"".join(bytes(f) for f in fields)
+    if developer_fields: d += bytes([len(developer_fields)]) + b"".join(bytes(f) for f in developer_fields)
+    return d
+
+
+def track(n=300):
+    # a synthetic track: FIT timestamps, and latitudes and longitudes in semicircles
+    a = np.linspace(0, 6 * np.pi, n)
+    lon = 4.35 + 0.01 * a * np.cos(a)
+    lat = 50.85 + 0.007 * a * np.sin(a)
+    timestamps = 1714550400 - FIT_EPOCH + 5 * np.arange(n)
+    semicircles = lambda x: np.round(x * 2**31 / 180).astype(int).tolist()
+    return timestamps.tolist(), semicircles(lat), semicircles(lon)
+
+
+RECORD_FIELDS = [(253,4,0x86), (0,4,0x85), (1,4,0x85)]
+
+
+def simple(ts, lats, lons, header_size=14):
+    messages = [definition(0, 20, RECORD_FIELDS)]
+    messages += [bytes([0]) + struct.pack("<Iii", t, la, lo) for t, la, lo in zip(ts, lats, lons)]
+    return fit_file(messages, header_size)
+
+
+def mixed(ts, lats, lons):
+    # other messages interleaved, big endian definition with another field order and an extra field,
+    # invalid values, developer fields, redefinition of a local message type, record without position
+    messages = [definition(0, 0, [(0,1,0x00)]), bytes([0, 4])]
+    messages.append(definition(1, 20, [(3,1,0x02), (1,4,0x85), (253,4,0x86), (0,4,0x85)], big_endian=True))
+    for i, (t, la, lo) in enumerate(zip(ts[:100], lats, lons)):
+        if i == 10: la = 0x7FFFFFFF
+        if i == 20: t = 0xFFFFFFFF
+        messages.append(bytes([1, 120]) + struct.pack(">iIi", lo, t, la))
+        if i % 17 == 0: messages.append(bytes([0, 4]))
+    messages += [definition(3, 207, [(3,1,0x02)]), bytes([3, 0])]
+    messages += [definition(4, 206, [(0,1,0x02), (1,1,0x02), (2,1,0x02), (3,4,0x07)]), bytes([4, 0, 0, 0x07]) + b"abc\x00"]
+    messages.append(definition(1, 20, RECORD_FIELDS, developer_fields=[(0,3,0)]))
+    messages += [bytes([1]) + struct.pack("<Iii", t, la, lo) + b"xyz" for t, la, lo in zip(ts[100:], lats[100:], lons[100:])]
+    messages += [definition(2, 20, [(253,4,0x86), (6,2,0x84)]), bytes([2]) + struct.pack("<IH", ts[-1] + 5, 300)]
+    return fit_file(messages)
+
+
+def compressed(ts, lats, lons):
+    # compressed timestamp headers: read with fitparse
+    messages = [definition(0, 20, RECORD_FIELDS), bytes([0]) + struct.pack("<Iii", ts[0], lats[0], lons[0])]
+    messages.append(definition(1, 20, [(0,4,0x85), (1,4,0x85)]))
+    for i in range(1, 20):
+        messages.append(bytes([0x80 | (1 << 5) | ((ts[i]) & 0x1F)]) + struct.pack("<ii", lats[i], lons[i]))
+    return fit_file(messages)
+
+
+if __name__ == "__main__":
+    os.makedirs(FOLDER, exist_ok=True)
+    ts, lats, lons = track()
+    files = {
+        "simple.fit": simple(ts, lats, lons),
+        "header12.fit": simple(ts[:50], lats[:50], lons[:50], header_size=12),
+        "mixed.fit": mixed(ts, lats, lons),
+        "compressed.fit": compressed(ts, lats, lons),
+        "chained.fit": simple(ts[:50], lats[:50], lons[:50]) + simple(ts[50:100], lats[50:100], lons[50:100]),
+        "empty.fit": fit_file([definition(0, 0, [(0,1,0x00)]), bytes([0, 4])])
+    }
+    for file, data in files.items():
+        with open(os.path.join(FOLDER, file), "wb") as f: f.write(data)
+    print(len(files), "files written to", FOLDER)
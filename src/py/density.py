@@ -0,0 +1,187 @@
+import os
+import json
+import struct
+import zlib
+import numpy as np
+import shapely
+from tile_archive import open_tile_archive_writer
+from tile_encoding import compress, decompress, tile_extension
+
+import sys
+sys.path.append('/home/juju/workspace/pyEx/src/')
+from utils.featureutils import iter_features
+
+
+# Density tiles: rasters of the number of traces passing through each pixel, as an alternative to the vector tiles
+# of tiler.tile for the low zoom levels. They use the same tiling grid: the pixel size of zoom level z is resolution_0 / 2^z,
+# and tile (ti, tj) covers the pixels ti*tile_size to (ti+1)*tile_size-1 along x, and tj*tile_size to (tj+1)*tile_size-1
+# along y, from the origin.
+# The counts of the finest zoom level are computed from the trace geometries. The coarser zoom levels are then derived,
+# by summing the counts of 2x2 pixels.
+# Tile rasters are tile_size x tile_size arrays, with the top row first. Two tile formats are available:
+# - "counts": the counts, as raw uint32 little endian values, possibly compressed.
+# - "png": a 16 bits grayscale PNG image of the counts, capped at 65535.
+
+
+def _encode_keys(kx, ky):
+    # encode pixel indices as single int64 keys
+    return ((kx + 2**30) << 32) | (ky + 2**30)
+
+def _decode_keys(keys):
+    return (keys >> 32) - 2**30, (keys & 0xFFFFFFFF) - 2**30
+
+
+def _reduce(keys, counts):
+    # sum the counts of the same keys
+    keys, inverse = np.unique(keys, return_inverse=True)
+    return keys, np.bincount(inverse.ravel(), weights=counts, minlength=len(keys)).astype(np.int64)
+
+
+def pixel_counts(fs, resolution, origin_x=0, origin_y=0, chunk_size=10000):
+    """
+    Compute the number of traces passing through each pixel of a grid.
+
+    Parameters:
+    - fs: The trace features. It can be a generator.
+    - resolution: The pixel size.
+    - origin_x, origin_y: The grid origin.
+    - chunk_size: The number of traces processed at once.
+
+    Returns:
+    - The pixel keys (see _encode_keys) and the counts, as arrays. Only the pixels with a non-zero count are included.
+    """
+    keys, counts = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    chunk = []
+
+    def add(chunk):
+        nonlocal keys, counts
+        # densify the lines so that all the pixels they cross contain a vertex
+        geoms = shapely.segmentize(np.array([f["geometry"] for f in chunk], dtype=object), resolution / 2)
+        coords, trace = shapely.get_coordinates(geoms, return_index=True)
+        kx = np.floor((coords[:,0] - origin_x) / resolution).astype(np.int64)
+        ky = np.floor((coords[:,1] - origin_y) / resolution).astype(np.int64)
+        # count each trace once per pixel
+        k = np.unique(np.column_stack((trace, _encode_keys(kx, ky))), axis=0)[:,1]
+        keys, counts = _reduce(np.concatenate((keys, k)), np.concatenate((counts, np.ones(len(k), dtype=np.int64))))
+
+    for f in fs:
+        chunk.append(f)
+        if len(chunk) == chunk_size:
+            add(chunk)
+            chunk = []
+    if chunk: add(chunk)
+    return keys, counts
+
+
+def coarser_counts(keys, counts):
+    """Compute the pixel counts of the next coarser zoom level, by summing the counts of 2x2 pixels."""
+    kx, ky = _decode_keys(keys)
+    return _reduce(_encode_keys(kx // 2, ky // 2), counts)
+
+
+def encode_png(counts):
+    """Encode a 2D array of counts as a 16 bits grayscale PNG image. Counts are capped at 65535."""
+    h, w = counts.shape
+    values = np.minimum(counts, 65535).astype('>u2').view(np.uint8).reshape(h, 2*w)
+    # one filter type byte (0: none) at the start of each row
+    rows = np.hstack((np.zeros((h, 1), dtype=np.uint8), values))
+
+    def chunk(chunk_type, data):
+        return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 16, 0, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(rows.tobytes(), 9)) + chunk(b"IEND", b""))
+
+
+def encode_counts(counts, tile_format="png", compression=None):
+    """Encode a tile raster of counts, in the "png" or "counts" tile format."""
+    if tile_format == "png": return encode_png(counts)
+    if tile_format == "counts": return compress(counts.astype('<u4').tobytes(), compression)
+    raise ValueError("Unknown density tile format: {}".format(tile_format))
+
+
+def decode_counts(data, tile_size, compression=None):
+    """Decode a tile raster encoded in the "counts" tile format."""
+    return np.frombuffer(decompress(data, compression), dtype='<u4').reshape(tile_size, tile_size)
+
+
+def density_tiles(keys, counts, tile_size=256):
+    """
+    Split pixel counts into tile rasters.
+
+    Returns:
+    - An iterator of (ti, tj, raster) tuples, where raster is a (tile_size, tile_size) array with the top row first.
+    """
+    kx, ky = _decode_keys(keys)
+    ti, tj = kx // tile_size, ky // tile_size
+    order = np.lexsort((tj, ti))
+    kx, ky, ti, tj, counts = kx[order], ky[order], ti[order], tj[order], counts[order]
+
+    # the limits of the groups of pixels of the same tile
+    starts = np.nonzero(np.concatenate(([True], (ti[1:] != ti[:-1]) | (tj[1:] != tj[:-1]))))[0]
+    ends = np.append(starts[1:], len(ti))
+    for s, e in zip(starts, ends):
+        raster = np.zeros((tile_size, tile_size), dtype=np.uint32)
+        raster[tile_size - 1 - (ky[s:e] - tj[s] * tile_size), kx[s:e] - ti[s] * tile_size] = counts[s:e]
+        yield int(ti[s]), int(tj[s]), raster
+
+
+def density(input_file, output_folder, z_min = 1, z_max = 10, tile_size = 256, resolution_0 = 250000, origin_x = 0, origin_y = 0, tile_format = "png", compression = None, archive_file = None):
+    """
+    Build a pyramid of density tiles, into a {z}/{ti}/{tj}.png folder structure with a metadata.json file, as tiler.tile.
+    The traces are read once, to compute the pixel counts of z_max. The other zoom levels are derived from them.
+
+    Parameters:
+    - input_file: The traces file.
+    - tile_format: The tile format, "png" or "counts". See above.
+    - compression: The tile compression of the "counts" format, None, "gzip" or "br". PNG tiles are not compressed further.
+    - archive_file: If specified, the tiles and metadata are written into this single tile archive file instead of the
+      output folder. See tile_archive.
+    """
+
+    metadata = {
+        "type" : "density",
+        "origin_x" : origin_x,
+        "origin_y" : origin_y,
+        "tile_size" : tile_size,
+        "resolution_0" : resolution_0,
+        "z_min" : z_min,
+        "z_max" : z_max,
+        "tile_format" : tile_format,
+        "compression" : compression
+    }
+    if tile_format == "png" and compression is not None: raise ValueError("PNG density tiles cannot be compressed")
+    extension = tile_extension(tile_format, compression)
+
+    writer = None
+    if archive_file: writer = open_tile_archive_writer(archive_file)
+    else:
+        os.makedirs(output_folder, exist_ok=True)
+        with open(os.path.join(output_folder, "metadata.json"), 'w') as json_file:
+            json.dump(metadata, json_file, indent=3)
+
+    try:
+        print("Density - zoom level", z_max)
+        keys, counts = pixel_counts(iter_features(input_file), resolution_0 / 2**z_max, origin_x, origin_y)
+        print(len(keys), "pixels")
+
+        for z in range(z_max, z_min-1, -1):
+            if z < z_max:
+                print("Density - zoom level", z)
+                keys, counts = coarser_counts(keys, counts)
+
+            nb = 0
+            for ti, tj, raster in density_tiles(keys, counts, tile_size):
+                data = encode_counts(raster, tile_format, compression)
+                if writer: writer.write(z, ti, tj, data)
+                else:
+                    output_file = os.path.join(output_folder, f"{z}/{ti}/{tj}.{extension}")
+                    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+                    with open(output_file, 'wb') as f: f.write(data)
+                nb += 1
+            print(nb, "tiles")
+    except:
+        # do not leave an incomplete tile archive
+        if writer: writer.abort()
+        raise
+    if writer: writer.close(metadata)
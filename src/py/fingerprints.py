@@ -0,0 +1,97 @@
+import os
+import json
+import numpy as np
+
+
+# Trace fingerprints, to detect the duplicate traces of an activity exported several times, for example from
+# the device and from Strava, possibly with slightly different start times or numbers of points.
+# A fingerprint is made of:
+# - the start time bucket: the start time divided by the bucket duration,
+# - the geometry key: the start point, end point and bounding box of the trace, quantised on a grid,
+# - the number of points.
+# Two traces are duplicates if they have start time buckets which are equal or adjacent, geometry keys whose values
+# differ by at most one grid cell, and numbers of points which differ by less than a tolerance. The tolerances make
+# the comparison robust to coordinates falling on both sides of a grid line, or of a bucket limit.
+# The fingerprints are indexed by start time bucket, so that a trace is compared only to the few traces starting
+# at about the same time.
+
+
+class FingerprintIndex:
+    """
+    An index of trace fingerprints, possibly persisted as a JSON file.
+
+    Parameters:
+    - file: The JSON file of the index. It is loaded if it exists. If None, the index is not persisted.
+    - time_bucket_s: The duration of the start time buckets, in seconds.
+    - grid: The grid size used to quantise the coordinates, in CRS units.
+    - count_tolerance: The maximum relative difference between the numbers of points of duplicates.
+    """
+
+    def __init__(self, file=None, time_bucket_s=600, grid=100, count_tolerance=0.1):
+        self.file = file
+        self.time_bucket_s = time_bucket_s
+        self.grid = grid
+        self.count_tolerance = count_tolerance
+        # the fingerprints, as [geometry key, number of points, identifier] lists, by start time bucket
+        self.buckets = {}
+        if file is not None and os.path.exists(file):
+            with open(file) as f: d = json.load(f)
+            self.time_bucket_s, self.grid, self.count_tolerance = d["time_bucket_s"], d["grid"], d["count_tolerance"]
+            self.buckets = { int(b): entries for b, entries in d["buckets"].items() }
+
+    def fingerprint(self, start_time, coords):
+        """
+        Compute the fingerprint of a trace.
+
+        Parameters:
+        - start_time: The trace start time, as a "%Y-%m-%d %H:%M:%S" string.
+        - coords: The (n,2) array of the trace coordinates.
+
+        Returns:
+        - The (start time bucket, geometry key, number of points) tuple. The geometry key is a list of 8 integers.
+        """
+        t = int(np.datetime64(start_time.replace(" ", "T"), 's').astype(np.int64))
+        coords = np.asarray(coords)[:, :2]
+        key = np.concatenate((coords[0], coords[-1], coords.min(axis=0), coords.max(axis=0)))
+        key = np.round(key / self.grid).astype(np.int64)
+        return t // self.time_bucket_s, key.tolist(), len(coords)
+
+    def find(self, fingerprint):
+        """Return the identifier of a duplicate of a trace fingerprint, or None."""
+        bucket, key, n = fingerprint
+        key = np.array(key)
+        for b in (bucket - 1, bucket, bucket + 1):
+            for key_, n_, identifier in self.buckets.get(b, []):
+                if abs(n_ - n) <= self.count_tolerance * max(n_, n) and np.abs(key - key_).max() <= 1: return identifier
+        return None
+
+    def add(self, fingerprint, identifier):
+        bucket, key, n = fingerprint
+        self.buckets.setdefault(bucket, []).append([key, n, identifier])
+
+    def add_if_new(self, start_time, coords, identifier):
+        """
+        Add a trace to the index, unless it is a duplicate of a trace already indexed.
+
+        Returns:
+        - The identifier of the duplicate trace, or None if the trace was added.
+        """
+        fingerprint = self.fingerprint(start_time, coords)
+        duplicate = self.find(fingerprint)
+        if duplicate is None: self.add(fingerprint, identifier)
+        return duplicate
+
+    def remove(self, identifiers):
+        """Remove the fingerprints of some traces."""
+        identifiers = set(identifiers)
+        if len(identifiers) == 0: return
+        for bucket in list(self.buckets.keys()):
+            entries = [e for e in self.buckets[bucket] if e[2] not in identifiers]
+            if entries: self.buckets[bucket] = entries
+            else: del self.buckets[bucket]
+
+    def save(self):
+        if self.file is None: return
+        with open(self.file, 'w') as f:
+            json.dump({ "time_bucket_s": self.time_bucket_s, "grid": self.grid, "count_tolerance": self.count_tolerance,
+                        "buckets": { str(b): entries for b, entries in self.buckets.items() } }, f)
@@ -0,0 +1,158 @@
+import io
+import struct
+import numpy as np
+from fitparse import FitFile
+
+
+# Fast reader of the positions and times of the 'record' messages of FIT files.
+# The file is scanned once to find the definition and data messages: only the message headers and the definitions
+# are decoded in python. The timestamp, position_lat and position_long fields of all record messages are then
+# extracted at once with numpy, from their byte offsets.
+# Files which cannot be handled this way (compressed timestamp headers, chained files, unexpected field types...)
+# are read with fitparse.
+
+# FIT epoch (1989-12-31 00:00:00 UTC), as a unix time
+FIT_EPOCH = 631065600
+
+RECORD_MESSAGE = 20
+TIMESTAMP_FIELD = 253
+POSITION_LAT_FIELD = 0
+POSITION_LONG_FIELD = 1
+
+# FIT base types of the fields: (base type, size, numpy type, invalid value)
+_FIELD_TYPES = {
+    TIMESTAMP_FIELD: (0x86, 4, 'u4', 0xFFFFFFFF),
+    POSITION_LAT_FIELD: (0x85, 4, 'i4', 0x7FFFFFFF),
+    POSITION_LONG_FIELD: (0x85, 4, 'i4', 0x7FFFFFFF)
+}
+
+
+class UnsupportedFitFile(Exception):
+    pass
+
+
+def _scan(data):
+    # find the record messages, as a list of (definition, message content offsets) pairs
+    if len(data) < 12: raise UnsupportedFitFile("File too short")
+    header_size = data[0]
+    data_size = struct.unpack_from("<I", data, 4)[0]
+    if header_size not in (12, 14) or data[8:12] != b".FIT": raise UnsupportedFitFile("Not a FIT file")
+    end = header_size + data_size
+    if end + 2 != len(data): raise UnsupportedFitFile("Truncated or chained FIT file")
+
+    # the current definitions, by local message type
+    definitions = {}
+    # the record definitions, with the offsets of their messages
+    records = []
+
+    pos = header_size
+    while pos < end:
+        h = data[pos]
+        if h & 0x80: raise UnsupportedFitFile("Compressed timestamp header")
+
+        if h & 0x40:
+            # definition message
+            big_endian = data[pos+2] == 1
+            global_number = struct.unpack_from(">H" if big_endian else "<H", data, pos+3)[0]
+            nb_fields = data[pos+5]
+            fields = {}
+            size = 0
+            for i in range(nb_fields):
+                number, field_size, base_type = data[pos+6+3*i], data[pos+7+3*i], data[pos+8+3*i]
+                fields[number] = (size, field_size, base_type)
+                size += field_size
+            pos += 6 + 3*nb_fields
+            # developer fields
+            if h & 0x20:
+                nb_dev_fields = data[pos]
+                size += sum(data[pos+2+3*i] for i in range(nb_dev_fields))
+                pos += 1 + 3*nb_dev_fields
+            definition = { "size": size, "record": global_number == RECORD_MESSAGE, "fields": fields, "big_endian": big_endian, "offsets": [] }
+            if definition["record"]: records.append(definition)
+            definitions[h & 0x0F] = definition
+
+        else:
+            # data message
+            definition = definitions.get(h & 0x0F)
+            if definition is None: raise UnsupportedFitFile("Undefined local message type")
+            if definition["record"]: definition["offsets"].append(pos + 1)
+            pos += 1 + definition["size"]
+
+    if pos != end: raise UnsupportedFitFile("Inconsistent message sizes")
+    return records
+
+
+def _field_values(buffer, definition, offsets, number):
+    # the values of a field of some messages, as a float array with NaN for invalid or missing values
+    field = definition["fields"].get(number)
+    if field is None: return np.full(len(offsets), np.nan)
+    base_type, size, dtype, invalid = _FIELD_TYPES[number]
+    offset, field_size, field_base_type = field
+    if field_size != size or (field_base_type & 0x1F) != (base_type & 0x1F): raise UnsupportedFitFile("Unexpected field type")
+
+    # gather the bytes of the field in all messages
+    values = buffer[offsets[:, None] + offset + np.arange(size)]
+    values = np.ascontiguousarray(values).view((">" if definition["big_endian"] else "<") + dtype).ravel()
+    return np.where(values == np.array(invalid).astype(dtype), np.nan, values.astype(float))
+
+
+def _read_fit_records_fast(data):
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    offsets, timestamps, lats, lons = [], [], [], []
+    for definition in _scan(data):
+        o = np.array(definition["offsets"], dtype=np.int64)
+        offsets.append(o)
+        timestamps.append(_field_values(buffer, definition, o, TIMESTAMP_FIELD))
+        lats.append(_field_values(buffer, definition, o, POSITION_LAT_FIELD))
+        lons.append(_field_values(buffer, definition, o, POSITION_LONG_FIELD))
+    if len(offsets) == 0: return np.zeros(0), np.zeros(0), np.zeros(0)
+
+    # order the messages of the different definitions
+    order = np.argsort(np.concatenate(offsets), kind='stable')
+    timestamps = np.concatenate(timestamps)[order]
+    # fitparse does not convert the timestamps lower than 0x10000000, which are relative times
+    if (timestamps < 0x10000000).any(): raise UnsupportedFitFile("Relative timestamps")
+    return timestamps, np.concatenate(lats)[order], np.concatenate(lons)[order]
+
+
+def _read_fit_records_fitparse(data):
+    timestamps, lats, lons = [], [], []
+    for record in FitFile(io.BytesIO(data)).get_messages('record'):
+        values = record.get_values()
+        time = values.get('timestamp')
+        lat = values.get('position_lat')
+        lon = values.get('position_long')
+        timestamps.append(np.nan if time is None else (np.datetime64(time, 's').astype(np.int64) - FIT_EPOCH))
+        lats.append(np.nan if lat is None else lat)
+        lons.append(np.nan if lon is None else lon)
+    return np.array(timestamps, dtype=float), np.array(lats, dtype=float), np.array(lons, dtype=float)
+
+
+def read_fit_records(source, fallback=True):
+    """
+    Read the times and positions of the record messages of a FIT file.
+
+    Parameters:
+    - source: The FIT file path, or a file object.
+    - fallback: Set to False to raise an UnsupportedFitFile exception instead of using fitparse,
+      when the file cannot be read by the fast reader.
+
+    Returns:
+    - The times as datetime64[s] values in UTC, and the latitudes and longitudes in degrees, as arrays.
+      Missing values are NaT or NaN.
+    """
+    if isinstance(source, str):
+        with open(source, 'rb') as f: data = f.read()
+    else: data = source.read()
+
+    try:
+        timestamps, lats, lons = _read_fit_records_fast(data)
+    except UnsupportedFitFile:
+        if not fallback: raise
+        timestamps, lats, lons = _read_fit_records_fitparse(data)
+
+    # convert the times, and the semicircles into degrees
+    time = np.full(len(timestamps), np.datetime64('NaT'), dtype='datetime64[s]')
+    valid = ~np.isnan(timestamps)
+    time[valid] = (timestamps[valid].astype(np.int64) + FIT_EPOCH).astype('datetime64[s]')
+    return time, lats * (180 / 2**31), lons * (180 / 2**31)
@@ -1,136 +1,350 @@
-from shapely.ops import linemerge
+import shapely
+import numpy as np
 import math
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import sys
 sys.path.append('/home/juju/workspace/pyEx/src/')
-from utils.featureutils import load_features, save_features_to_gpkg
+from utils.featureutils import load_features, iter_features, save_features_stream
 
 
 
 def resolutionise(geometry, resolution):
-    if geometry.is_empty:
-        return geometry
+    """
+    Snap the coordinates of geometries to a grid.
 
-#np.round(coords).astype(int)
-    def _reso(x):
-        return resolution * round(x/resolution)
+    Parameters:
+    - geometry: A shapely geometry, or an array of shapely geometries, of any type.
+    - resolution: The grid resolution.
 
-    def _resos(coords):
-        return tuple([_reso(coords[0]), _reso(coords[1])])
+    Returns:
+    - The snapped geometry, or array of geometries.
+    """
+    # all coordinates are snapped at once, as a numpy array
+    return shapely.transform(geometry, lambda coords: resolution * np.round(coords / resolution))
 
-    if geometry.geom_type == 'Point':
-        return type(geometry)(*map(_resos, [geometry.coords[0]]))
-    elif geometry.geom_type in ['LineString', 'LinearRing']:
-        return type(geometry)(list(map(_resos, geometry.coords)))
-    elif geometry.geom_type == 'Polygon':
-        exterior = list(map(_resos, geometry.exterior.coords))
-        interiors = [list(map(_resos, ring.coords)) for ring in geometry.interiors]
-        return type(geometry)(exterior, interiors)
-    elif geometry.geom_type == 'MultiPoint':
-        return type(geometry)([type(geometry.geoms[0])(list(map(_resos, geom.coords))) for geom in geometry.geoms])
-    elif geometry.geom_type == 'MultiLineString':
-        return type(geometry)([type(geometry.geoms[0])(list(map(_resos, geom.coords))) for geom in geometry.geoms])
-    elif geometry.geom_type == 'MultiPolygon':
-        return type(geometry)([
-            type(geometry.geoms[0])(
-                list(map(_resos, geom.exterior.coords)),
-                [list(map(_resos, ring.coords)) for ring in geom.interiors]
-            )
-            for geom in geometry.geoms
-        ])
-    else:
-        raise ValueError("Unhandled geometry type: {}".format(geometry.geom_type))
 
 
 
 
+def iter_chunks(iterable, chunk_size):
+    # split an iterable into lists of chunk_size elements
+    chunk = []
+    for e in iterable:
+        chunk.append(e)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk: yield chunk
 
-def simplify_traces(input_gpkg_path, output_gpkg_path, resolution, out_epsg = "3857", iterations=5):
 
-    # load input data
-    print("Load data from", input_gpkg_path)
-    fs = load_features(input_gpkg_path)
-    print(len(fs))
+def _simplify_step(geoms, resolution):
+    # one generalisation iteration on an array of geometries: simplification, snapping and merging of the multi lines
+    geoms = resolutionise(shapely.simplify(geoms, resolution), resolution)
+    multi = shapely.get_type_id(geoms) == 5
+    if multi.any(): geoms[multi] = shapely.line_merge(geoms[multi])
+    return geoms
+
 
-    fs_out = []
-    for f in fs:
-        geom = f["geometry"]
+def simplify_geometries(geoms, resolution, iterations=5, nb_threads=1, stats=None):
+    """
+    Generalise an array of traces with vectorised operations. Each iteration simplifies, snaps and merges all the geometries at once.
+    The geometries which did not change during an iteration have converged: they are left out of the next iterations.
 
-        #simplify lines
+    Parameters:
+    - geoms: The array of geometries.
+    - resolution: The generalisation resolution.
+    - iterations: The maximum number of iterations.
+    - nb_threads: The number of threads. The geometries of an iteration are split between the threads: shapely releases the GIL
+      in its vectorised operations.
+    - stats: A list to record, for each iteration, the number of processed geometries, the number of converged geometries,
+      and the duration in seconds. The values of successive calls are summed.
+
+    Returns:
+    - The array of the generalised geometries. The geometries shorter than the resolution are replaced by their centroid.
+      Some geometries may be empty.
+    """
+    geoms = np.array(geoms, dtype=object)
+    active = np.arange(len(geoms))
+
+    with ThreadPoolExecutor(nb_threads) as executor:
         for i in range(iterations):
-            geom = geom.simplify(resolution)
-            geom = resolutionise(geom, resolution)
-            try: geom = linemerge(geom)
-            except: pass
-            if geom.is_empty: break
+            if len(active) == 0: break
+            t = time.perf_counter()
 
-        if geom.is_empty: continue
+            before = geoms[active]
+            if nb_threads <= 1 or len(before) < 2*nb_threads: after = _simplify_step(before, resolution)
+            else: after = np.concatenate(list(executor.map(lambda chunk: _simplify_step(chunk, resolution), np.array_split(before, nb_threads))))
+            geoms[active] = after
 
-        #check point
-        if(geom.length <= resolution):
-            geom = geom.centroid
-            #print(geom)
+            # keep only the geometries still changing
+            converged = shapely.equals_exact(before, after, tolerance=0) | shapely.is_empty(after)
+            active = active[~converged]
 
-        f['geometry'] = geom
-        fs_out.append(f)
+            if stats is not None:
+                if len(stats) <= i: stats.append([0, 0, 0.0])
+                stats[i][0] += len(before)
+                stats[i][1] += int(converged.sum())
+                stats[i][2] += time.perf_counter() - t
 
-    print("save as GPKG", len(fs_out))
-    save_features_to_gpkg(fs_out, output_gpkg_path, out_epsg)
+    #check point
+    short = ~shapely.is_empty(geoms) & (shapely.length(geoms) <= resolution)
+    geoms[short] = shapely.centroid(geoms[short])
 
+    return geoms
+
+
+def simplify_trace(geom, resolution, iterations=5):
+    return simplify_geometries([geom], resolution, iterations)[0]
 
-def simplify_traces_z(input_gpkg_path, output_gpkg_path, z_min = 1, z_max = 10, resolution_0 = 250000, iterations=5, out_epsg = "3857"):
-    for z in range(z_min, z_max+1):
-        print("Generalising - zoom level", z)
-        d = math.pow(2, z)
-        resolution = resolution_0 / d
-        simplify_traces(input_gpkg_path, output_gpkg_path+str(z)+".gpkg", resolution, iterations=iterations, out_epsg = out_epsg)
 
+def print_simplification_stats(stats):
+    for i, (nb, nb_converged, duration) in enumerate(stats):
+        print("  iteration", i+1, ":", nb, "geometries,", nb_converged, "converged,", round(duration, 3), "s")
 
 
+def simplify_traces(input_gpkg_path, output_gpkg_path, resolution, out_epsg = "3857", iterations=5, nb_threads=1, chunk_size=10000):
 
+    stats = []
 
+    # features are streamed from the input file to the output file, by chunks generalised at once
+    def _simplified(fs):
+        for chunk in iter_chunks(fs, chunk_size):
+            geoms = simplify_geometries([f["geometry"] for f in chunk], resolution, iterations, nb_threads, stats)
+            for f, geom in zip(chunk, geoms):
+                if geom.is_empty: continue
+                f['geometry'] = geom
+                yield f
 
+    print("Generalise data from", input_gpkg_path)
+    nb = save_features_stream(_simplified(iter_features(input_gpkg_path)), output_gpkg_path, out_epsg)
+    print_simplification_stats(stats)
+    print("saved as GPKG", nb)
 
 
+# the output files extension can be "gpkg" or "parquet", for GeoParquet
+# the traces are generalised as a network for the zoom levels in network_zooms, see simplify_traces_network
+def simplify_traces_z(input_gpkg_path, output_gpkg_path, z_min = 1, z_max = 10, resolution_0 = 250000, iterations=5, out_epsg = "3857", extension = "gpkg", nb_threads = 1, network_zooms = []):
+    for z in range(z_min, z_max+1):
+        print("Generalising - zoom level", z)
+        d = math.pow(2, z)
+        resolution = resolution_0 / d
+        if z in network_zooms: simplify_traces_network(input_gpkg_path, output_gpkg_path+str(z)+"."+extension, resolution, iterations=iterations, out_epsg = out_epsg, nb_threads = nb_threads)
+        else: simplify_traces(input_gpkg_path, output_gpkg_path+str(z)+"."+extension, resolution, iterations=iterations, out_epsg = out_epsg, nb_threads = nb_threads)
 
 
 
+def simplify_traces_cascade(input_gpkg_path, output_gpkg_path, z_min = 1, z_max = 10, resolution_0 = 250000, iterations=5, out_epsg = "3857", single_file = False, extension = "gpkg", nb_threads = 1):
+    """
+    Generalise traces for several zoom levels in a single pass.
+    The input data is loaded once, and generalised from the finest to the coarsest zoom level:
+    the output of a zoom level is the input of the next coarser one.
 
-def simplify_traces_segments(input_gpkg_path, output_gpkg_path, resolution, out_epsg = "3857"):
+    Parameters:
+    - output_gpkg_path: The output file prefix, as for simplify_traces_z. With single_file, the output file path,
+      with one layer per geometry type and zoom level, named "<geometry type>_<z>".
+    - single_file: Set to True to save all zoom levels in a single GeoPackage.
+    - extension: The output files extension, "gpkg", or "parquet" for GeoParquet files. GeoParquet cannot be used with single_file.
+    - nb_threads: The number of threads used to generalise the geometries, see simplify_geometries.
+    """
 
     # load input data
     print("Load data from", input_gpkg_path)
     fs = load_features(input_gpkg_path)
     print(len(fs))
 
-    fs_out = []
-    for f in fs:
-        geom = f["geometry"]
+    for z in range(z_max, z_min-1, -1):
+        print("Generalising - zoom level", z)
+        d = math.pow(2, z)
+        resolution = resolution_0 / d
+
+        stats = []
+        geoms = simplify_geometries([f["geometry"] for f in fs], resolution, iterations, nb_threads, stats)
+        print_simplification_stats(stats)
+        fs_z = [dict(f, geometry=geom) for f, geom in zip(fs, geoms) if not geom.is_empty]
+
+        # the features are used as input for the next zoom level
+        fs = fs_z
+
+        print("save as GPKG", len(fs))
+        if single_file: save_features_stream(fs, output_gpkg_path, out_epsg, layer_suffix="_"+str(z))
+        else: save_features_stream(fs, output_gpkg_path+str(z)+"."+extension, out_epsg)
+
+
+
+def _aggregate(keys, count, first, last, speed):
+    # merge the rows with the same key: counts and speeds are summed, first times are the minimum, and last times the maximum
+    keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    count_, speed_ = np.zeros(len(keys), dtype=np.int64), np.zeros(len(keys))
+    first_, last_ = np.full(len(keys), np.iinfo(np.int64).max), np.full(len(keys), np.iinfo(np.int64).min)
+    np.add.at(count_, inverse, count)
+    np.add.at(speed_, inverse, speed)
+    np.minimum.at(first_, inverse, first)
+    np.maximum.at(last_, inverse, last)
+    return keys, count_, first_, last_, speed_
+
+
+def _orient(a, b):
+    # orient edges from their lowest to their highest vertex
+    swap = (a[:,0] > b[:,0]) | ((a[:,0] == b[:,0]) & (a[:,1] > b[:,1]))
+    a[swap], b[swap] = b[swap], a[swap]
+    return a, b
+
+
+def _edges(geoms, resolution, first, last, speed):
+    # the unit grid edges of snapped lines, oriented from their lowest to their highest vertex, with the attributes of their trace
+    # the segments are split into steps between neighbour grid nodes, so that coincident segments give the same edges,
+    # whatever their vertices
+    parts, trace = shapely.get_parts(geoms, return_index=True)
+    coords, part = shapely.get_coordinates(parts, return_index=True)
+    coords = np.round(coords / resolution).astype(np.int64)
+    i = np.nonzero(part[:-1] == part[1:])[0]
+    a, b = _orient(coords[i], coords[i+1])
+    keep = (a != b).any(axis=1)
+    a, b, t = a[keep], b[keep], trace[part[i]][keep]
+
+    # the k-th node of a segment of n steps is a + round(d*k/n), computed with integers so that collinear segments
+    # give the same nodes
+    d = b - a
+    n = np.abs(d).max(axis=1)
+    segment = np.repeat(np.arange(len(n)), n)
+    k = np.arange(len(segment)) - np.repeat(np.cumsum(n) - n, n)
+    n_, d_, a_ = n[segment][:,None], d[segment], a[segment]
+    a = a_ + (2 * d_ * k[:,None] + n_) // (2 * n_)
+    b = a_ + (2 * d_ * (k[:,None] + 1) + n_) // (2 * n_)
+    a, b = _orient(a * resolution, b * resolution)
+    t = t[segment]
+    return np.hstack((a, b)), np.ones(len(t), dtype=np.int64), first[t], last[t], speed[t]
+
+
+def _times(fs, key):
+    return np.array([np.datetime64(f[key].replace(" ", "T"), 's') for f in fs]).astype(np.int64)
+
+
+def _time_strings(values):
+    return np.char.replace(np.datetime_as_string(np.array(values).astype('datetime64[s]'), unit='s'), "T", " ").tolist()
+
+
+def network_generalise(fs, resolution, iterations=5, nb_threads=1, chunk_size=10000):
+    """
+    Generalise traces as a network: the traces are generalised and snapped to the resolution grid, and their edges
+    which coincide are merged into a single edge, for all traces. The edges are then merged into lines, where they
+    have the same number of passes. The traces shorter than the resolution become points, merged in the same way.
+
+    Parameters:
+    - fs: The trace features, with 'start_time', 'end_time' and 'speed_kmh' attributes. It can be a generator.
+    - resolution: The generalisation resolution.
+    - iterations: The maximum number of generalisation iterations, see simplify_geometries.
+    - nb_threads: The number of threads, see simplify_geometries.
+    - chunk_size: The number of traces processed at once.
+
+    Returns:
+    - The list of the network features, with the number of passes 'count', the earliest start time 'first_time' and the latest
+      end time 'last_time' of the traces passing there, and their mean speed 'speed_kmh'.
+    """
+
+    # partial aggregates of the edges and points, by chunk
+    edges, points = [], []
+    for chunk in iter_chunks(fs, chunk_size):
+        geoms = simplify_geometries([f["geometry"] for f in chunk], resolution, iterations, nb_threads)
+        first, last = _times(chunk, "start_time"), _times(chunk, "end_time")
+        speed = np.array([f["speed_kmh"] for f in chunk], dtype=float)
+
+        lines = shapely.get_type_id(geoms) != 0
+        edges.append(_aggregate(*_edges(geoms[lines], resolution, first[lines], last[lines], speed[lines])))
+
+        pts = ~lines & ~shapely.is_empty(geoms)
+        xy = shapely.get_coordinates(resolutionise(geoms[pts], resolution))
+        points.append(_aggregate(xy, np.ones(len(xy), dtype=np.int64), first[pts], last[pts], speed[pts]))
+
+    if len(edges) == 0: return []
+    edges = _aggregate(*[np.concatenate(e) for e in zip(*edges)])
+    points = _aggregate(*[np.concatenate(p) for p in zip(*points)])
+    out = []
+    if len(edges[0]) > 0: out += _network_lines(*edges, resolution)
+
+    keys, count, first, last, speed = points
+    if len(keys) == 0: return out
+    for xy, c, f, l, s in zip(keys, count.tolist(), _time_strings(first), _time_strings(last), (speed / np.maximum(count, 1)).tolist()):
+        out.append({ "geometry": shapely.Point(xy), "count": c, "first_time": f, "last_time": l, "speed_kmh": round(s) })
+    return out
+
+
+def _network_lines(keys, count, first, last, speed, resolution):
+    # merge the edges with the same count into line features
+
+    lines = []
+    for c in np.unique(count):
+        e = keys[count == c]
+        merged = shapely.line_merge(shapely.multilinestrings(shapely.linestrings(e.reshape(-1, 2, 2))))
+        lines.append(shapely.get_parts(merged))
+    lines = np.concatenate(lines)
+
+    # aggregate the attributes of the edges of each line. The edges of the lines are the edges of the graph, whose index is found from their coordinates.
+    line_edges, _, line_of_edge, _, _ = _edges(lines, resolution, np.arange(len(lines)), np.zeros(len(lines), dtype=np.int64), np.zeros(len(lines)))
+    edge_index = np.unique(np.vstack((keys, line_edges)), axis=0, return_inverse=True)[1].ravel()[len(keys):]
+    line_count = np.zeros(len(lines), dtype=np.int64)
+    line_count[line_of_edge] = count[edge_index]
+    line_first, line_last = np.full(len(lines), np.iinfo(np.int64).max), np.full(len(lines), np.iinfo(np.int64).min)
+    np.minimum.at(line_first, line_of_edge, first[edge_index])
+    np.maximum.at(line_last, line_of_edge, last[edge_index])
+    line_speed = np.bincount(line_of_edge, weights=speed[edge_index], minlength=len(lines)) / np.bincount(line_of_edge, weights=count[edge_index], minlength=len(lines))
+
+    # the unit steps of the lines are not needed anymore: the nodes of a split segment are within half a grid step
+    # of the segment, so that a simplification of half the resolution removes them
+    lines = shapely.simplify(lines, resolution / 2)
+
+    out = []
+    for geom, c, f, l, s in zip(lines, line_count.tolist(), _time_strings(line_first), _time_strings(line_last), line_speed.tolist()):
+        out.append({ "geometry": geom, "count": c, "first_time": f, "last_time": l, "speed_kmh": round(s) })
+    return out
+
+
+def simplify_traces_network(input_gpkg_path, output_gpkg_path, resolution, out_epsg = "3857", iterations=5, nb_threads=1):
+    """Generalise traces as a network, see network_generalise. The traces are streamed from the input file."""
+    print("Generalise data as a network from", input_gpkg_path)
+    fs = network_generalise(iter_features(input_gpkg_path, columns=["start_time", "end_time", "speed_kmh"]), resolution, iterations, nb_threads)
+    nb = save_features_stream(fs, output_gpkg_path, out_epsg)
+    print("saved as GPKG", nb)
+
+
+
+def simplify_traces_segments(input_gpkg_path, output_gpkg_path, resolution, out_epsg = "3857", chunk_size = 10000):
+
+    # features are streamed from the input file to the output file, by chunks
+    def _simplified(fs):
+        for chunk in iter_chunks(fs, chunk_size):
+
+            # resolutionise all geometries of the chunk at once
+            geoms = resolutionise(np.array([f["geometry"] for f in chunk], dtype=object), resolution)
 
-        geom = resolutionise(geom, resolution)
+            for f, geom in zip(chunk, geoms):
 
-        if geom.is_empty: continue
+                if geom.is_empty: continue
 
-        #check point
-        if(geom.length == 0): continue
+                #check point
+                if(geom.length == 0): continue
 
-        f['geometry'] = geom
-        fs_out.append(f)
+                f['geometry'] = geom
+                yield f
 
-    print("save as GPKG", len(fs_out))
-    save_features_to_gpkg(fs_out, output_gpkg_path, out_epsg)
+    print("Generalise data from", input_gpkg_path)
+    nb = save_features_stream(_simplified(iter_features(input_gpkg_path)), output_gpkg_path, out_epsg)
+    print("saved as GPKG", nb)
 
 
 
 
 
-def simplify_traces_segments_z(input_gpkg_path, output_gpkg_path, z_min = 1, z_max = 10, resolution_0 = 250000, out_epsg = "3857"):
+def simplify_traces_segments_z(input_gpkg_path, output_gpkg_path, z_min = 1, z_max = 10, resolution_0 = 250000, out_epsg = "3857", extension = "gpkg"):
     for z in range(z_min, z_max+1):
         print("Generalising - zoom level", z)
         d = math.pow(2, z)
         resolution = resolution_0 / d
         #print(resolution)
-        simplify_traces_segments(input_gpkg_path, output_gpkg_path+str(z)+".gpkg", resolution, out_epsg = out_epsg)
+        simplify_traces_segments(input_gpkg_path, output_gpkg_path+str(z)+"."+extension, resolution, out_epsg = out_epsg)
 
 
 
@@ -0,0 +1,65 @@
+from lxml import etree
+from datetime import datetime, timezone
+import numpy as np
+
+
+def parse_time(text):
+    """Parse a GPX time, as a naive UTC datetime."""
+    t = datetime.fromisoformat(text.strip())
+    if t.tzinfo is not None: t = t.astimezone(timezone.utc).replace(tzinfo=None)
+    return t
+
+
+def _local_name(tag):
+    return tag.rpartition('}')[2]
+
+
+def read_gpx_segments(source):
+    """
+    Read the track segments of a GPX file, as numpy arrays.
+    The file is read as a stream: no object is built for the track points.
+
+    Parameters:
+    - source: The GPX file path, or a file object.
+
+    Returns:
+    - The list of track segments, each as a (lon, lat, time) tuple of arrays. Coordinates are in degrees,
+      and times are numpy datetime64[s] values in UTC. Missing times are NaT.
+    """
+    segments = []
+    lons, lats, times = [], [], []
+
+    for event, el in etree.iterparse(source, events=('end',), tag=('{*}trkpt', '{*}trkseg')):
+        name = _local_name(el.tag)
+
+        if name == 'trkpt':
+            lons.append(float(el.get('lon')))
+            lats.append(float(el.get('lat')))
+            time = el.findtext('{*}time')
+            times.append(parse_time(time) if time else None)
+
+        elif name == 'trkseg':
+            segments.append((np.array(lons, dtype=float), np.array(lats, dtype=float), np.array(times, dtype='datetime64[s]')))
+            lons, lats, times = [], [], []
+
+        # free memory
+        el.clear()
+        while el.getprevious() is not None:
+            del el.getparent()[0]
+
+    return segments
+
+
+def read_gpx_start_time(source):
+    """
+    Return the time of the first track point of a GPX file, as a naive UTC datetime, or None.
+    The file is read only up to this point.
+
+    Parameters:
+    - source: The GPX file path, or a file object.
+    """
+    for event, el in etree.iterparse(source, events=('end',), tag='{*}trkpt'):
+        time = el.findtext('{*}time')
+        if time: return parse_time(time)
+        el.clear()
+    return None
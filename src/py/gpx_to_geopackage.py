@@ -1,15 +1,23 @@
 import os
 import geopandas as gpd
-from shapely.geometry import LineString
-from shapely.ops import transform
+from shapely.geometry import LineString, MultiLineString
 import pyproj
-import gpxpy
-from datetime import datetime
+import numpy as np
+import pandas as pd
+import shapely
 import math
+import hashlib
+import json
+import sqlite3
+from multiprocessing import Pool
+from track_reader import read_track_segments, track_format, track_name
+from fingerprints import FingerprintIndex
+
+import sys
+sys.path.append('/home/juju/workspace/pyEx/src/')
+from utils.tracestoreutils import write_trace_store, open_trace_store
 #from geopy.distance import geodesic
 
-date_format = "%Y-%m-%d %H:%M:%S"
-
 '''
 def haversine_distance(point1, point2):
     """Calculate the Haversine distance between two (lat, lon) points."""
@@ -42,147 +50,474 @@ def haversine(coord1, coord2):
     return distance
 
 
+def haversine_np(lat1, lon1, lat2, lon2):
+    """Calculate the Haversine distances between two arrays of points in meters. This is the vectorised version of haversine."""
+    R = 6371000
+
+    # Convert latitude and longitude from degrees to radians
+    lat1 = np.radians(lat1)
+    lon1 = np.radians(lon1)
+    lat2 = np.radians(lat2)
+    lon2 = np.radians(lon2)
+
+    # Haversine formula
+    a = np.sin((lat2 - lat1) / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return R * c
+
+
 def linestring_length_haversine(linestring):
-    """Calculate the length of a Shapely LineString in meters using the Haversine formula."""
-    total_length = 0
-    coords = list(linestring.coords)
-    
-    for i in range(len(coords) - 1):
-        total_length += haversine(coords[i], coords[i + 1])
-    
-    return total_length
+    """Calculate the length of a Shapely LineString with (lon, lat) coordinates in meters using the Haversine formula."""
+    coords = shapely.get_coordinates(linestring)
+    return float(np.sum(haversine_np(coords[:-1,1], coords[:-1,0], coords[1:,1], coords[1:,0])))
 
 
+def segment_attributes(lon, lat, time):
+    """
+    Compute the attributes of the segments between consecutive points of a track, in one pass.
 
+    Parameters:
+    - lon, lat: The point coordinates arrays, in degrees.
+    - time: The point times array, as datetime64 values.
 
-def create_geopackage_from_gpx(folder_path, output_file, out_epsg = "3857"):
+    Returns:
+    - The segment lengths in meters, durations in seconds and speeds in km/h, as arrays. Speeds are 0 when durations are 0.
+    """
+    length_m = haversine_np(lat[:-1], lon[:-1], lat[1:], lon[1:])
+    duration_s = (time[1:] - time[:-1]).astype('timedelta64[s]').astype(float)
+    speed = np.divide(3.6 * length_m, duration_s, out=np.zeros_like(length_m), where=duration_s > 0)
+    return length_m, duration_s, speed
 
-    id = 1
 
-    files = os.listdir(folder_path)
-    print(len(files),"files")
 
-    # TODO use gdf.to_crs instead ?
-    projector = pyproj.Transformer.from_crs("EPSG:4326", "EPSG:"+out_epsg, always_xy=True).transform
 
+def read_trace_arrays_from_gpx(file_path, projector, file_id):
+    """
+    Read the traces of a GPX, TCX or FIT file as arrays, one trace per track segment.
+
+    Parameters:
+    - file_path: The GPX, TCX or FIT file path.
+    - projector: The function to project the coordinates.
+    - file_id: The file identifier, used to build stable trace identifiers.
+
+    Returns:
+    - The list of traces, as (xy, time, attributes) tuples, with xy the (n,2) array of the projected coordinates,
+      time the array of the point times, and attributes a dictionnary.
+    """
     traces = []
+    n = 1
+    for lon, lat, time in read_track_segments(file_path):
+        if len(lon) <= 1: continue
+        if np.isnat(time[0]) or np.isnat(time[-1]): raise ValueError("Missing track point time")
+        length_m = round(linestring_length_haversine(LineString(np.column_stack((lon, lat)))))
+        duration_s = int((time[-1]-time[0]).astype(int))
+        x, y = projector(lon, lat)
+        traces.append((np.column_stack((x, y)), time, {
+            'identifier': file_id + "_" + str(n),
+            'length_m': length_m,
+            'duration_s': duration_s,
+            "speed_kmh": round(length_m/duration_s * 3.6),
+            'start_time': str(time[0]).replace("T"," "),
+            'end_time': str(time[-1]).replace("T"," ")
+        }))
+        n += 1
+    return traces
+
+
+def read_traces_from_gpx(file_path, projector, file_id):
+    """
+    Read the traces of a GPX file, one trace per track segment. See read_trace_arrays_from_gpx.
+
+    Returns:
+    - The list of traces, as dictionnaries.
+    """
+    return [dict({ 'geometry': LineString(xy) }, **attributes) for xy, time, attributes in read_trace_arrays_from_gpx(file_path, projector, file_id)]
+
+
+# coordinate projection functions, by EPSG code
+_projectors = {}
+
+def get_projector(out_epsg):
+    """Return the function projecting WGS84 coordinates into a CRS. Projection functions are cached, per process."""
+    if out_epsg not in _projectors:
+        _projectors[out_epsg] = pyproj.Transformer.from_crs("EPSG:4326", "EPSG:"+out_epsg, always_xy=True).transform
+    return _projectors[out_epsg]
+
+
+def _read_file(task):
+    # read a file, catching the error
+    (read_fun, file_path, file_id, out_epsg) = task
+    try:
+        return read_fun(file_path, get_projector(out_epsg), file_id), None
+    except Exception as e:
+        return [], str(e)
+
+
+def read_files(read_fun, file_paths, file_ids, out_epsg, nb_processes=1):
+    """
+    Read several files with a reading function, possibly in parallel.
+
+    Parameters:
+    - read_fun: The reading function, with (file_path, projector, file_id) as parameters. It must be a module level function.
+    - file_paths: The file paths.
+    - file_ids: The file identifiers.
+    - out_epsg: The output EPSG code.
+    - nb_processes: The number of processes to use.
+
+    Returns:
+    - The list of (result, error) pairs, in the order of the files. The error is None when the file could be read.
+    """
+    tasks = [(read_fun, file_path, file_id, out_epsg) for file_path, file_id in zip(file_paths, file_ids)]
+    if nb_processes <= 1: return list(map(_read_file, tasks))
+    with Pool(nb_processes) as pool:
+        return pool.map(_read_file, tasks, chunksize=max(1, len(tasks) // (4*nb_processes)))
+
+
+def list_track_files(folder_path):
+    """
+    List the files of a folder, sorted by name. The trace identifiers are made from the track file names without
+    their extensions (see track_reader.track_name), so track files with the same name, for example 'x.gpx' and
+    'x.gpx.gz', or 'x.fit' and 'x.gpx', are refused: their traces would get the same identifiers.
+    """
+    files = sorted(os.listdir(folder_path))
+    names = {}
     for file in files:
-        try:
-            file_path = os.path.join(folder_path, file)
-            with open(file_path, 'r') as gpx_file:
-                gpx = gpxpy.parse(gpx_file)
-                for track in gpx.tracks:
-                    for segment in track.segments:
-                        if len(segment.points) <= 1: continue
-                        points = [(point.longitude, point.latitude) for point in segment.points]
-                        times = [point.time for point in segment.points]
-                        line = LineString(points)
-                        start_time = str(times[0]).replace("+00:00","")
-                        end_time = str(times[-1]).replace("+00:00","")
-                        length_m = round(linestring_length_haversine(line))
-                        duration_s = round((datetime.strptime(end_time, date_format)-datetime.strptime(start_time, date_format)).total_seconds())
-                        line = transform(projector, line)
-                        traces.append({
-                            'geometry': line,
-                            'identifier': str(id),
-                            'length_m': length_m,
-                            'duration_s': duration_s,
-                            "speed_kmh": round(length_m/duration_s * 3.6),
-                            'start_time': start_time,
-                            'end_time': end_time
-                        })
-                        id += 1
-
-        except Exception as e:
-            print("Error when reading file: "+file)
-            print(e)
+        if track_format(file) is None: continue
+        names.setdefault(track_name(file), []).append(file)
+    collisions = [fs for fs in names.values() if len(fs) > 1]
+    if len(collisions) > 0:
+        raise ValueError("Track files with the same name, whose traces would have the same identifiers: " + "; ".join(", ".join(fs) for fs in collisions))
+    return files
 
-    print(len(traces),"traces loaded")
 
-    gdf = gpd.GeoDataFrame(traces, crs="EPSG:"+out_epsg)
-    gdf.to_file(output_file, layer='gps_traces', driver='GPKG')
+def report_errors(errors):
+    """Print the file reading errors, given as a list of (file, error message) pairs."""
+    if len(errors) == 0: return
+    print(len(errors), "files could not be read:")
+    for file, e in errors: print(" ", file, ":", e)
 
 
+def file_hash(file_path):
+    """Compute the SHA-1 hash of a file content."""
+    h = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
 
-def create_geopackage_segments_from_gpx(folder_path, output_file, out_epsg="3857"):
-    """Convert GPX files in a folder to a GeoPackage containing segments with attributes."""
 
-    segments_data = []
-    id = 1
+def load_manifest(manifest_file):
+    if not os.path.exists(manifest_file): return {}
+    with open(manifest_file, 'r') as f:
+        return json.load(f)
+
+def save_manifest(manifest, manifest_file):
+    with open(manifest_file, 'w') as f:
+        json.dump(manifest, f, indent=1)
+
+
+def delete_traces_from_gpkg(gpkg_file, identifiers, layer='gps_traces'):
+    """Delete the traces with some identifiers from a GeoPackage layer."""
+    identifiers = list(identifiers)
+    with sqlite3.connect(gpkg_file) as con:
+        for i in range(0, len(identifiers), 500):
+            chunk = identifiers[i:i+500]
+            con.execute('DELETE FROM "'+layer+'" WHERE identifier IN ('+",".join("?"*len(chunk))+')', chunk)
+
+
+
+def save_gdf(gdf, output_file, layer):
+    """Save a GeoDataFrame as a GeoPackage layer, or as a GeoParquet file if the file extension is '.parquet'."""
+    if output_file.endswith(".parquet"): gdf.to_parquet(output_file, index=False)
+    else: gdf.to_file(output_file, layer=layer, driver='GPKG')
+
+
+def update_parquet(output_file, gdf, identifiers):
+    """Update a GeoParquet file: remove the traces with some identifiers, and append new ones. The file is rewritten."""
+    existing = gpd.read_parquet(output_file)
+    existing = existing[~existing['identifier'].isin(list(identifiers))]
+    if gdf is not None: existing = pd.concat([existing, gdf.to_crs(existing.crs)], ignore_index=True)
+    existing.to_parquet(output_file, index=False)
+
 
-    files = os.listdir(folder_path)
+
+def create_geopackage_from_gpx(folder_path, output_file, out_epsg = "3857", incremental = False, manifest_file = None, nb_processes = 1, dedup = False, fingerprint_file = None):
+    """
+    Convert GPX files in a folder to a GeoPackage containing one trace per track segment.
+    TCX and FIT files are read directly as well, without conversion to GPX, and gzipped files are decompressed while they are read.
+
+    Parameters:
+    - folder_path: The GPX files folder.
+    - output_file: The output GeoPackage file, or GeoParquet file if its extension is '.parquet'.
+    - out_epsg: The output EPSG code.
+    - incremental: Set to True to parse only the new or changed files since the last run, and update the
+      output file with their traces only. The traces of removed files are removed. The files which could not be
+      read are read again at the next run.
+    - manifest_file: The file listing the processed files. Default is the output file path + ".manifest.json".
+    - nb_processes: The number of processes used to read the files.
+    - dedup: Set to True to skip the traces which are duplicates of traces already loaded, for example the same activity
+      exported twice. See fingerprints.FingerprintIndex. With incremental, the files with skipped duplicates of
+      removed traces are read again, so that these duplicates replace them.
+    - fingerprint_file: The fingerprint index file. Default is the output file path + ".fingerprints.json".
+
+    Returns:
+    - The changes, as a dictionnary with the identifiers of the added and removed traces, their bounds,
+      the file reading errors, and the skipped duplicates, as (identifier, identifier of the duplicated trace) pairs.
+    """
+
+    if manifest_file is None: manifest_file = output_file + ".manifest.json"
+    if fingerprint_file is None: fingerprint_file = output_file + ".fingerprints.json"
+
+    files = list_track_files(folder_path)
     print(len(files),"files")
 
-    # Iterate over all GPX files in the folder
+    # previously processed files
+    incremental = incremental and os.path.exists(output_file)
+    manifest = load_manifest(manifest_file) if incremental else {}
+    index = None
+    if dedup:
+        if not incremental and os.path.exists(fingerprint_file): os.remove(fingerprint_file)
+        index = FingerprintIndex(fingerprint_file)
+
+    # find the files to read
+    to_read = []
+    to_delete = []
+    changed_bounds = []
     for file in files:
-        if not file.endswith(".gpx"): continue
-
-        gpx_path = os.path.join(folder_path, file)
-        print(file)
-
-        try:
-
-            # Parse the GPX file
-            with open(gpx_path, 'r') as gpx_file:
-                gpx = gpxpy.parse(gpx_file)
-                
-                # Iterate over all tracks and segments in the GPX file
-                for track in gpx.tracks:
-                    for segment in track.segments:
-                        points = segment.points
-                        if len(points) <= 1: continue
-
-                        p0 = points[0]
-                        for i in range(1,len(points)):
-                            p1 = points[i]
-
-                            #make segment p0,p1
-                            t0 = p0.time
-                            t1 = p1.time
-                            start_time = str(t0).replace("+00:00","")
-                            end_time = str(t1).replace("+00:00","")
-                            duration_s = (datetime.strptime(end_time, date_format)-datetime.strptime(start_time, date_format)).total_seconds()
-                            length_m = haversine([p0.latitude, p0.longitude],[p1.latitude, p1.longitude])
-                            speed = 3.6 * length_m / duration_s if duration_s > 0 else 0
-                            line = LineString([(point.longitude, point.latitude) for point in [p0,p1]])
-
-                            # Store segment data
-                            segments_data.append({
-                                'geometry': line,
-                                'identifier': str(id),
-                                'start_time': str(start_time).replace("+00:00",""),
-                                'end_time': str(end_time).replace("+00:00",""),
-                                'duration_s': round(duration_s),
-                                'length_m': round(length_m),
-                                'speed': round(speed)
-                            })
-                            id+=1
-
-                            p0 = p1
-
-                        #points = [(point.longitude, point.latitude) for point in segment.points]
-                        #times = [point.time for point in segment.points]
-
-                        # Extract coordinates and times
-                        #coords = [(point.longitude, point.latitude) for point in points]
-                        #times = [point.time for point in points]
-                        
-                        # Calculate segment attributes
-                        #length_m = sum(haversine_distance(coords[i], coords[i+1]) for i in range(len(coords)-1))
-                        #speed = (length_m / 1000) / (duration_s / 3600) if duration_s > 0 else 0
-
-                        # Create a LineString geometry
-                        #line = LineString(coords)
-                        
-        except Exception as e:
-            print("Error when reading file: "+file)
-            print(e)
-
-    print(len(segments_data),"segments loaded")
-
-    gdf = gpd.GeoDataFrame(segments_data, crs="EPSG:4326")
-    gdf = gdf.to_crs(epsg=int(out_epsg))
-    gdf.to_file(output_file, layer='gps_segments', driver='GPKG')
+        file_path = os.path.join(folder_path, file)
+        stat = os.stat(file_path)
+
+        # check if the file has changed since the last run
+        m = manifest.get(file)
+        if m and m["size"] == stat.st_size and m["mtime"] == stat.st_mtime: continue
+        h = file_hash(file_path)
+        if m and m["hash"] == h:
+            m["mtime"] = stat.st_mtime
+            continue
+
+        # changed file: its previous traces are replaced
+        if m:
+            to_delete += m["identifiers"]
+            if m.get("bounds"): changed_bounds.append(m["bounds"])
+
+        to_read.append((file, stat, h))
+
+    # removed files
+    for file in set(manifest.keys()) - set(files):
+        m = manifest.pop(file)
+        to_delete += m["identifiers"]
+        if m.get("bounds"): changed_bounds.append(m["bounds"])
+
+    # unchanged files with skipped duplicates of removed traces: they are read again, so that their duplicates
+    # are loaded in place of the removed traces. This may in turn remove traces other duplicates point to.
+    removed = set(to_delete)
+    reading = set(file for file, _, _ in to_read)
+    again = index is not None
+    while again:
+        again = False
+        for file in files:
+            m = manifest.get(file)
+            if m is None or file in reading: continue
+            if not any(original in removed for _, original in m.get("duplicates", [])): continue
+            to_delete += m["identifiers"]
+            removed.update(m["identifiers"])
+            if m.get("bounds"): changed_bounds.append(m["bounds"])
+            to_read.append((file, os.stat(os.path.join(folder_path, file)), m["hash"]))
+            reading.add(file)
+            again = True
+    to_read.sort(key=lambda r: r[0])
+    if index is not None: index.remove(to_delete)
+
+    # read files
+    # TODO use gdf.to_crs instead ?
+    results = read_files(read_traces_from_gpx, [os.path.join(folder_path, file) for file, _, _ in to_read], [track_name(file) for file, _, _ in to_read], out_epsg, nb_processes)
+
+    # merge, in the files order
+    traces = []
+    errors = []
+    duplicates = []
+    for (file, stat, h), (ts, error) in zip(to_read, results):
+        if error:
+            # not recorded in the manifest, so that the file is read again at the next run
+            errors.append((file, error))
+            manifest.pop(file, None)
+            continue
+        file_duplicates = []
+        if index is not None:
+            ts_ = []
+            for t in ts:
+                duplicate = index.add_if_new(t["start_time"], shapely.get_coordinates(t["geometry"]), t["identifier"])
+                if duplicate is None: ts_.append(t)
+                else: file_duplicates.append((t["identifier"], duplicate))
+            ts = ts_
+            duplicates += file_duplicates
+        traces += ts
+        bounds = list(MultiLineString([t["geometry"] for t in ts]).bounds) if len(ts) > 0 else None
+        if bounds: changed_bounds.append(bounds)
+        manifest[file] = { "size": stat.st_size, "mtime": stat.st_mtime, "hash": h, "identifiers": [t["identifier"] for t in ts], "bounds": bounds, "duplicates": file_duplicates }
+
+    report_errors(errors)
+    print(len(traces),"traces loaded")
+    if index is not None: print(len(duplicates),"duplicate traces skipped")
+
+    if incremental:
+        print(len(to_delete),"traces removed")
+        gdf = gpd.GeoDataFrame(traces, crs="EPSG:"+out_epsg) if len(traces) > 0 else None
+        if output_file.endswith(".parquet"):
+            update_parquet(output_file, gdf, to_delete)
+        else:
+            delete_traces_from_gpkg(output_file, to_delete)
+            if gdf is not None: gdf.to_file(output_file, layer='gps_traces', driver='GPKG', mode='a')
+    else:
+        gdf = gpd.GeoDataFrame(traces, crs="EPSG:"+out_epsg)
+        save_gdf(gdf, output_file, 'gps_traces')
+
+    save_manifest(manifest, manifest_file)
+    if index is not None: index.save()
+
+    return { "added": [t["identifier"] for t in traces], "removed": to_delete, "bounds": changed_bounds, "errors": errors, "duplicates": duplicates }
+
+
+def create_trace_store_from_gpx(folder_path, store_folder, out_epsg = "3857", quantisation = None, nb_processes = 1, dedup = False):
+    """
+    Convert GPX files in a folder to a trace store containing one trace per track segment (see utils.tracestoreutils).
+    The traces and their attributes are the same as the ones of create_geopackage_from_gpx, with their point times.
+    The store can then be used instead of the GeoPackage, with a path ending with '.traces'.
+
+    Parameters:
+    - folder_path: The GPX files folder.
+    - store_folder: The trace store folder.
+    - out_epsg: The output EPSG code.
+    - quantisation: The coordinates quantisation step, in meters. If specified, coordinates are stored as int32 values.
+    - nb_processes: The number of processes used to read the files.
+    - dedup: Set to True to skip the duplicate traces, as in create_geopackage_from_gpx. The fingerprint index is saved in the store folder.
+
+    Returns:
+    - The file reading errors.
+    """
+
+    files = list_track_files(folder_path)
+    print(len(files),"files")
+
+    results = read_files(read_trace_arrays_from_gpx, [os.path.join(folder_path, file) for file in files], [track_name(file) for file in files], out_epsg, nb_processes)
+
+    # merge, in the files order
+    traces = []
+    errors = []
+    index = FingerprintIndex() if dedup else None
+    for file, (ts, error) in zip(files, results):
+        if error: errors.append((file, error))
+        if index is not None: ts = [t for t in ts if index.add_if_new(t[2]["start_time"], t[0], t[2]["identifier"]) is None]
+        traces += ts
+
+    report_errors(errors)
+    nb = write_trace_store(traces, store_folder, out_epsg, quantisation)
+    print(nb,"traces stored")
+    if index is not None:
+        index.file = os.path.join(store_folder, "fingerprints.json")
+        index.save()
+    return errors
+
+
+def read_segments_from_gpx(file_path, projector, file_id):
+    """
+    Read the segments of a GPX file, one segment per pair of consecutive track points.
+
+    Parameters:
+    - file_path: The GPX file path.
+    - projector: The function to project the coordinates.
+    - file_id: The file identifier - not used.
+
+    Returns:
+    - The list of the segments of each track segment, as GeoDataFrames. Their identifier is not set.
+    """
+
+    segments_data = []
+
+    # Iterate over all track segments in the GPX file
+    for lon, lat, time in read_track_segments(file_path):
+        if len(lon) <= 1: continue
+        if np.isnat(time).any(): raise ValueError("Missing track point time")
+
+        # segment attributes
+        length_m, duration_s, speed = segment_attributes(lon, lat, time)
+        times = np.char.replace(np.datetime_as_string(time, unit='s'), "T", " ")
+
+        # segment geometries
+        x, y = projector(lon, lat)
+        xy = np.column_stack((x, y))
+        lines = shapely.linestrings(np.stack((xy[:-1], xy[1:]), axis=1))
 
+        segments_data.append(gpd.GeoDataFrame({
+            'identifier': None,
+            'start_time': times[:-1],
+            'end_time': times[1:],
+            'duration_s': np.round(duration_s).astype(int),
+            'length_m': np.round(length_m).astype(int),
+            'speed': np.round(speed).astype(int)
+        }, geometry=lines))
 
+    return segments_data
 
+
+def create_geopackage_segments_from_gpx(folder_path, output_file, out_epsg="3857", nb_processes=1):
+    """Convert GPX files in a folder to a GeoPackage containing segments with attributes. The output file is a GeoParquet file if its extension is '.parquet'."""
+
+    files = sorted(os.listdir(folder_path))
+    print(len(files),"files")
+
+    # Read all track files in the folder
+    files = [file for file in files if track_format(file) is not None]
+    results = read_files(read_segments_from_gpx, [os.path.join(folder_path, file) for file in files], files, out_epsg, nb_processes)
+
+    # merge, in the files order, and set identifiers
+    segments_data = []
+    errors = []
+    for file, (segments, error) in zip(files, results):
+        if error: errors.append((file, error))
+        segments_data += segments
+
+    report_errors(errors)
+    if len(segments_data) == 0:
+        print("No segment loaded")
+        return errors
+
+    gdf = pd.concat(segments_data, ignore_index=True).set_crs("EPSG:"+out_epsg, allow_override=True)
+    gdf['identifier'] = (np.arange(len(gdf)) + 1).astype(str)
+    print(len(gdf),"segments loaded")
+
+    save_gdf(gdf, output_file, 'gps_segments')
+
+    return errors
+
+
+def create_geopackage_segments_from_trace_store(store_folder, output_file):
+    """
+    Convert the traces of a trace store to a GeoPackage containing segments with attributes, as create_geopackage_segments_from_gpx.
+    The segments of all traces are computed at once, from the store arrays. Segments with missing times are ignored.
+    """
+    store = open_trace_store(store_folder)
+    xy = store.coordinates()
+    time = np.asarray(store.times)
+
+    # segment attributes, from the WGS84 coordinates
+    lon, lat = pyproj.Transformer.from_crs("EPSG:"+store.epsg, "EPSG:4326", always_xy=True).transform(xy[:,0], xy[:,1])
+    length_m, duration_s, speed = segment_attributes(lon, lat, time)
+    times = np.char.replace(np.datetime_as_string(time, unit='s'), "T", " ")
+
+    # ignore the segments between the last point of a trace and the first point of the next one
+    keep = ~np.isnat(time[:-1]) & ~np.isnat(time[1:])
+    keep[np.asarray(store.offsets[1:-1]) - 1] = False
+    i = np.nonzero(keep)[0]
+
+    gdf = gpd.GeoDataFrame({
+        'identifier': (np.arange(len(i)) + 1).astype(str),
+        'start_time': times[i],
+        'end_time': times[i+1],
+        'duration_s': np.round(duration_s[i]).astype(int),
+        'length_m': np.round(length_m[i]).astype(int),
+        'speed': np.round(speed[i]).astype(int)
+    }, geometry=shapely.linestrings(np.stack((xy[i], xy[i+1]), axis=1)), crs="EPSG:"+store.epsg)
+    print(len(gdf),"segments loaded")
+
+    save_gdf(gdf, output_file, 'gps_segments')
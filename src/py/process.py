@@ -1,25 +1,28 @@
 
 from uncompress_rename_convert_to_gpx import uncompress_gz_files, convert_to_gpx
-from gpx_to_geopackage import create_geopackage_from_gpx, create_geopackage_segments_from_gpx
-from generalisation import simplify_traces_z
+from gpx_to_geopackage import create_geopackage_from_gpx, create_geopackage_segments_from_gpx, create_trace_store_from_gpx
+from generalisation import simplify_traces_z, simplify_traces_cascade
 from tiler import tile
+from density import density
 
 folder = "/home/juju/geodata/GPS/"
 new_data_folder = "/home/juju/geodata/GPS/strava_export_2025_07_24/"
 gpx_folder = folder + "traces/"
 
 # convert new file into GPX - remove duplicates
-#uncompress_gz_files(new_data_folder)
+#uncompress_gz_files(new_data_folder) # not needed anymore: gzipped files are read directly
 #convert_to_gpx(new_data_folder, gpx_folder)
 
 print("GPX to GPKG")
 create_geopackage_from_gpx(gpx_folder, folder + "traces.gpkg")
+#create_trace_store_from_gpx(gpx_folder, folder + "traces.traces")
 #create_geopackage_segments_from_gpx(gpx_folder, folder + "traces_segments.gpkg")
 
 print("generalisation")
 simplify_traces_z(folder + "traces.gpkg", folder + "traces_", z_min=3, z_max=15, out_epsg = "3857")
+#simplify_traces_cascade(folder + "traces.gpkg", folder + "traces_", z_min=3, z_max=15, out_epsg = "3857")
 #simplify_traces_segments_z(folder + "traces_segments.gpkg", folder + "traces_segments_", z_min=3, z_max=15, out_epsg = "3857")
 
 print("tiling")
 tile(lambda z: folder + "traces_"+str(z)+".gpkg", folder + "tiled/", z_min=3, z_max=15, origin_x=-9000000, origin_y=-6000000)
-
+#density(folder + "traces.gpkg", folder + "density/", z_min=3, z_max=10, origin_x=-9000000, origin_y=-6000000)
@@ -0,0 +1,208 @@
+import os
+import json
+import sqlite3
+import struct
+import hashlib
+import numpy as np
+from tile_encoding import tile_extension
+
+
+# Tile archives: all tiles of a tiling in a single indexed file, instead of one file per tile.
+# Two formats are available:
+# - mbtiles: a SQLite database, with the MBTiles tables 'tiles' and 'metadata'.
+#   Tiles are stored with tile_column=ti and tile_row=tj, in the tiling grid (see tiler.tile).
+#   As in the MBTiles specification, the metadata values are text: the scalar values are stored as strings, and
+#   the structured ones (dictionnaries, lists) are gathered into the JSON object of the 'json' entry. None values
+#   are not stored. When reading, the numeric strings are converted back into numbers.
+# - tar-like "tiles" file, in the spirit of PMTiles: the tile data, followed by a directory of byte offsets.
+#   The file structure is:
+#     header: magic (8 bytes), directory offset, directory length, metadata offset, metadata length (uint64, little endian)
+#     tile data
+#     directory: one (z int32, ti int32, tj int32, offset uint64, length uint64) record per tile, sorted by (z, ti, tj)
+#     metadata: UTF-8 JSON
+#   Identical tiles are stored once.
+
+TILES_MAGIC = b"GLMTILE1"
+_TILES_HEADER = struct.Struct("<8sQQQQ")
+_TILES_DIRECTORY_DTYPE = np.dtype([("z", "<i4"), ("ti", "<i4"), ("tj", "<i4"), ("offset", "<u8"), ("length", "<u8")])
+
+
+class MBTilesWriter:
+    """Write tiles into a MBTiles SQLite file. Tiles are inserted by batches, one transaction per batch."""
+
+    def __init__(self, path, batch_size=1000):
+        if os.path.exists(path): os.remove(path)
+        self.con = sqlite3.connect(path)
+        self.con.execute("CREATE TABLE metadata (name TEXT, value TEXT)")
+        self.con.execute("CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB)")
+        self.batch_size = batch_size
+        self.batch = []
+
+    def write(self, z, ti, tj, data):
+        self.batch.append((z, ti, tj, data))
+        if len(self.batch) >= self.batch_size: self.flush()
+
+    def flush(self):
+        with self.con:
+            self.con.executemany("INSERT INTO tiles VALUES (?,?,?,?)", self.batch)
+        self.batch = []
+
+    def close(self, metadata={}):
+        self.flush()
+        rows = [(k, str(v)) for k, v in metadata.items() if v is not None and not isinstance(v, (dict, list))]
+        structured = { k: v for k, v in metadata.items() if isinstance(v, (dict, list)) }
+        if structured: rows.append(("json", json.dumps(structured)))
+        with self.con:
+            self.con.executemany("INSERT INTO metadata VALUES (?,?)", rows)
+            self.con.execute("CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row)")
+        self.con.close()
+
+    def abort(self):
+        """Close the writer after a failure, and remove the incomplete file."""
+        path = self.con.execute("PRAGMA database_list").fetchone()[2]
+        self.con.close()
+        if os.path.exists(path): os.remove(path)
+
+
+def _metadata_value(text):
+    # a MBTiles metadata value, as a number if possible
+    for convert in (int, float):
+        try: return convert(text)
+        except ValueError: pass
+    return text
+
+
+class MBTilesReader:
+    """Read tiles from a MBTiles SQLite file."""
+
+    def __init__(self, path):
+        self.con = sqlite3.connect(path)
+
+    def get(self, z, ti, tj):
+        row = self.con.execute("SELECT tile_data FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?", (z, ti, tj)).fetchone()
+        return row[0] if row else None
+
+    def tiles(self):
+        """Iterate over all (z, ti, tj, data) tiles."""
+        for row in self.con.execute("SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles ORDER BY zoom_level, tile_column, tile_row"):
+            yield row
+
+    def metadata(self):
+        metadata = {}
+        for k, v in self.con.execute("SELECT name, value FROM metadata"):
+            if k == "json": metadata.update(json.loads(v))
+            else: metadata[k] = _metadata_value(v)
+        return metadata
+
+    def close(self):
+        self.con.close()
+
+
+class TilesFileWriter:
+    """Write tiles into a single file, with a directory of byte offsets. See the format description above."""
+
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+        self.file.write(_TILES_HEADER.pack(TILES_MAGIC, 0, 0, 0, 0))
+        self.entries = []
+        # offset and length of the tile contents already written, by hash
+        self.contents = {}
+
+    def write(self, z, ti, tj, data):
+        h = hashlib.sha1(data).digest()
+        if h not in self.contents:
+            self.contents[h] = (self.file.tell(), len(data))
+            self.file.write(data)
+        offset, length = self.contents[h]
+        self.entries.append((z, ti, tj, offset, length))
+
+    def close(self, metadata={}):
+        directory = np.array(self.entries, dtype=_TILES_DIRECTORY_DTYPE)
+        directory.sort(order=["z", "ti", "tj"])
+        directory_offset = self.file.tell()
+        self.file.write(directory.tobytes())
+        metadata = json.dumps(metadata).encode("utf-8")
+        metadata_offset = self.file.tell()
+        self.file.write(metadata)
+        self.file.seek(0)
+        self.file.write(_TILES_HEADER.pack(TILES_MAGIC, directory_offset, directory.nbytes, metadata_offset, len(metadata)))
+        self.file.close()
+
+    def abort(self):
+        """Close the writer after a failure, and remove the incomplete file."""
+        self.file.close()
+        if os.path.exists(self.file.name): os.remove(self.file.name)
+
+
+class TilesFileReader:
+    """Read tiles from a file written with TilesFileWriter."""
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        magic, directory_offset, directory_length, self.metadata_offset, self.metadata_length = _TILES_HEADER.unpack(self.file.read(_TILES_HEADER.size))
+        if magic != TILES_MAGIC: raise ValueError("Not a tiles file: " + path)
+        self.file.seek(directory_offset)
+        self.directory = np.frombuffer(self.file.read(directory_length), dtype=_TILES_DIRECTORY_DTYPE)
+        self.index = { (int(e["z"]), int(e["ti"]), int(e["tj"])): i for i, e in enumerate(self.directory) }
+
+    def _read(self, e):
+        self.file.seek(int(e["offset"]))
+        return self.file.read(int(e["length"]))
+
+    def get(self, z, ti, tj):
+        i = self.index.get((z, ti, tj))
+        return None if i is None else self._read(self.directory[i])
+
+    def tiles(self):
+        """Iterate over all (z, ti, tj, data) tiles."""
+        for e in self.directory:
+            yield int(e["z"]), int(e["ti"]), int(e["tj"]), self._read(e)
+
+    def metadata(self):
+        self.file.seek(self.metadata_offset)
+        return json.loads(self.file.read(self.metadata_length).decode("utf-8"))
+
+    def close(self):
+        self.file.close()
+
+
+
+def open_tile_archive_writer(path):
+    """
+    Open a tile archive writer. The format depends on the file extension: '.mbtiles' for MBTiles, and the tiles file otherwise.
+    The writer has write(z, ti, tj, data) and close(metadata) methods, and an abort() method to call on failure.
+    """
+    return MBTilesWriter(path) if path.endswith(".mbtiles") else TilesFileWriter(path)
+
+def open_tile_archive(path):
+    """Open a tile archive reader. The format depends on the file extension: '.mbtiles' for MBTiles, and the tiles file otherwise."""
+    return MBTilesReader(path) if path.endswith(".mbtiles") else TilesFileReader(path)
+
+
+def export_tile_archive(path, output_folder, extension=None):
+    """
+    Export the tiles of an archive into the {z}/{ti}/{tj}.geojson folder layout of tiler.tile, with its metadata.json file.
+
+    Parameters:
+    - path: The tile archive file.
+    - output_folder: The output folder.
+    - extension: The tile files extension. By default, it depends on the tile format and compression of the archive metadata.
+    """
+    archive = open_tile_archive(path)
+    metadata = archive.metadata()
+    if extension is None:
+        extension = tile_extension(metadata.get("tile_format", "geojson"), metadata.get("compression"))
+    os.makedirs(output_folder, exist_ok=True)
+    # the attribute table is saved as a separate file, as with tiler.tile
+    if "attributes" in metadata:
+        with open(os.path.join(output_folder, "attributes.json"), 'w') as json_file:
+            json.dump(metadata.pop("attributes"), json_file, separators=(',', ':'))
+        metadata["attribute_table"] = "attributes.json"
+    with open(os.path.join(output_folder, "metadata.json"), 'w') as json_file:
+        json.dump(metadata, json_file, indent=3)
+    for z, ti, tj, data in archive.tiles():
+        output_file = os.path.join(output_folder, f"{z}/{ti}/{tj}.{extension}")
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        with open(output_file, 'wb') as f:
+            f.write(data)
+    archive.close()
@@ -0,0 +1,255 @@
+import struct
+import gzip
+import numpy as np
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Compact binary tile encoding, as an alternative to GeoJSON.
+# Tile coordinates are small integers (pixel coordinates within the tile), which are delta-encoded
+# and written as zig-zag varints. All integers are varints (LEB128), and strings are a varint byte length
+# followed by the UTF-8 bytes.
+#
+#   tile     := magic "GLT2", string crs, varint nb_keys, string key*, varint nb_features, feature*
+#   feature  := byte has_id (0 or 1), [string id], value*  (one value per key, in the keys order), geometry
+#   value    := byte type, then: 0 null | 1 zig-zag varint integer | 2 float64 (little endian) | 3 string | 4 true | 5 false
+#               | 6 absent (the feature does not have this property)
+#   geometry := byte type, then:
+#                 1 Point:           coord
+#                 2 LineString:      line
+#                 3 Polygon:         varint nb_rings, line*
+#                 4 MultiPoint:      line
+#                 5 MultiLineString: varint nb_lines, line*
+#                 6 MultiPolygon:    varint nb_polygons, (varint nb_rings, line*)*
+#   line     := varint nb_coords, coord*
+#   coord    := zig-zag varint dx, zig-zag varint dy
+#
+# Coordinates are the differences with the previous coordinate of the feature, starting from (0,0).
+
+TILE_MAGIC = b"GLT2"
+
+_GEOMETRY_TYPES = ["Point", "LineString", "Polygon", "MultiPoint", "MultiLineString", "MultiPolygon"]
+
+
+def _varints(values):
+    """Encode an array of non-negative integers as varints."""
+    v = np.asarray(values, dtype=np.uint64)
+    if len(v) == 0: return b""
+
+    # one column per varint byte
+    bytes_ = []
+    valid = []
+    while True:
+        bytes_.append((v & np.uint64(0x7F)).astype(np.uint8))
+        valid.append(np.ones(len(v), dtype=bool) if len(valid) == 0 else v > 0)
+        v = v >> np.uint64(7)
+        if not v.any(): break
+        # set the continuation bit
+        bytes_[-1] |= np.where(v > 0, 0x80, 0).astype(np.uint8)
+
+    bytes_ = np.column_stack(bytes_)
+    valid = np.column_stack(valid)
+    return bytes_[valid].tobytes()
+
+
+def _zigzag(values):
+    v = np.asarray(values, dtype=np.int64)
+    return (v << 1) ^ (v >> 63)
+
+
+def _string(s):
+    b = s.encode("utf-8")
+    return _varints([len(b)]) + b
+
+
+def _line(coords, cursor):
+    # encode a line, relative to the cursor (the previous coordinate)
+    coords = np.asarray(coords, dtype=np.int64).reshape(-1, 2)
+    if len(coords) == 0: return _varints([0]), cursor
+    deltas = np.diff(coords, axis=0, prepend=[cursor])
+    return _varints([len(coords)]) + _varints(_zigzag(deltas.ravel())), coords[-1]
+
+
+def _geometry(geometry):
+    gtype = geometry["type"]
+    coords = geometry["coordinates"]
+    out = [bytes([_GEOMETRY_TYPES.index(gtype) + 1])]
+    cursor = np.zeros(2, dtype=np.int64)
+
+    if gtype == "Point":
+        out.append(_varints(_zigzag(np.asarray(coords, dtype=np.int64)[:2])))
+    elif gtype in ["LineString", "MultiPoint"]:
+        b, cursor = _line(coords, cursor)
+        out.append(b)
+    elif gtype in ["Polygon", "MultiLineString"]:
+        out.append(_varints([len(coords)]))
+        for line in coords:
+            b, cursor = _line(line, cursor)
+            out.append(b)
+    elif gtype == "MultiPolygon":
+        out.append(_varints([len(coords)]))
+        for polygon in coords:
+            out.append(_varints([len(polygon)]))
+            for line in polygon:
+                b, cursor = _line(line, cursor)
+                out.append(b)
+    else:
+        raise ValueError("Unhandled geometry type: {}".format(gtype))
+    return b"".join(out)
+
+
+_ABSENT = object()
+
+def _value(v):
+    if v is _ABSENT: return b"\x06"
+    if v is None: return b"\x00"
+    if v is True: return b"\x04"
+    if v is False: return b"\x05"
+    if isinstance(v, int): return b"\x01" + _varints(_zigzag([v]))
+    if isinstance(v, float): return b"\x02" + struct.pack("<d", v)
+    return b"\x03" + _string(str(v))
+
+
+def encode_binary_tile(geojson_dict):
+    """
+    Encode a tile GeoJSON feature collection with integer coordinates into the binary tile format.
+
+    Parameters:
+    - geojson_dict: The tile, as produced by tiler.tile_features.
+
+    Returns:
+    - The encoded tile, as bytes.
+    """
+    features = geojson_dict["features"]
+
+    # property keys, in order of appearance
+    keys = []
+    for f in features:
+        for k in f["properties"]:
+            if k not in keys: keys.append(k)
+
+    crs = geojson_dict.get("crs", {}).get("properties", {}).get("name", "")
+    out = [TILE_MAGIC, _string(crs), _varints([len(keys)])]
+    out += [_string(k) for k in keys]
+    out.append(_varints([len(features)]))
+    for f in features:
+        if "id" in f: out += [b"\x01", _string(str(f["id"]))]
+        else: out.append(b"\x00")
+        props = f["properties"]
+        for k in keys: out.append(_value(props.get(k, _ABSENT)))
+        out.append(_geometry(f["geometry"]))
+    return b"".join(out)
+
+
+
+class _Reader:
+    # sequential reader of an encoded tile
+
+    def __init__(self, data):
+        self.data = data
+        self.i = 0
+
+    def byte(self):
+        b = self.data[self.i]
+        self.i += 1
+        return b
+
+    def varint(self):
+        result = 0
+        shift = 0
+        while True:
+            b = self.byte()
+            result |= (b & 0x7F) << shift
+            if b < 0x80: return result
+            shift += 7
+
+    def zigzag(self):
+        v = self.varint()
+        return (v >> 1) ^ -(v & 1)
+
+    def string(self):
+        n = self.varint()
+        s = self.data[self.i:self.i+n].decode("utf-8")
+        self.i += n
+        return s
+
+    def value(self):
+        t = self.byte()
+        if t == 0: return None
+        if t == 1: return self.zigzag()
+        if t == 2:
+            v = struct.unpack_from("<d", self.data, self.i)[0]
+            self.i += 8
+            return v
+        if t == 3: return self.string()
+        if t == 6: return _ABSENT
+        return t == 4
+
+    def line(self, cursor):
+        coords = []
+        for _ in range(self.varint()):
+            cursor[0] += self.zigzag()
+            cursor[1] += self.zigzag()
+            coords.append([cursor[0], cursor[1]])
+        return coords
+
+    def geometry(self):
+        gtype = _GEOMETRY_TYPES[self.byte() - 1]
+        cursor = [0, 0]
+        if gtype == "Point": coords = [self.zigzag(), self.zigzag()]
+        elif gtype in ["LineString", "MultiPoint"]: coords = self.line(cursor)
+        elif gtype in ["Polygon", "MultiLineString"]: coords = [self.line(cursor) for _ in range(self.varint())]
+        else: coords = [[self.line(cursor) for _ in range(self.varint())] for _ in range(self.varint())]
+        return { "type": gtype, "coordinates": coords }
+
+
+def decode_binary_tile(data):
+    """
+    Decode a tile encoded with encode_binary_tile, as a GeoJSON feature collection.
+    """
+    r = _Reader(data)
+    if r.data[:4] != TILE_MAGIC: raise ValueError("Not a binary tile")
+    r.i = 4
+    crs = r.string()
+    keys = [r.string() for _ in range(r.varint())]
+    geojson_dict = {"type":"FeatureCollection", "features": [], "crs":{"type":"name","properties":{"name":crs}}}
+    for _ in range(r.varint()):
+        f = { "type":"Feature" }
+        if r.byte(): f["id"] = r.string()
+        props = {}
+        for k in keys:
+            v = r.value()
+            if v is not _ABSENT: props[k] = v
+        f["properties"] = props
+        f["geometry"] = r.geometry()
+        geojson_dict["features"].append(f)
+    return geojson_dict
+
+
+
+def tile_extension(tile_format="geojson", compression=None):
+    """Return the tile file extension, for example "geojson", "bin" or "bin.gz"."""
+    return tile_format + { None: "", "gzip": ".gz", "br": ".br" }[compression]
+
+
+def compress(data, compression=None):
+    """Compress tile data with 'gzip' or 'br' (brotli, which requires the brotli module). No compression if None."""
+    if compression is None: return data
+    if compression == "gzip": return gzip.compress(data, mtime=0)
+    if compression == "br":
+        if brotli is None: raise ImportError("The brotli module is required for brotli compression")
+        return brotli.compress(data)
+    raise ValueError("Unknown compression: {}".format(compression))
+
+
+def decompress(data, compression=None):
+    """Decompress tile data compressed with compress."""
+    if compression is None: return data
+    if compression == "gzip": return gzip.decompress(data)
+    if compression == "br":
+        if brotli is None: raise ImportError("The brotli module is required for brotli compression")
+        return brotli.decompress(data)
+    raise ValueError("Unknown compression: {}".format(compression))
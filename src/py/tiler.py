@@ -1,56 +1,57 @@
 import os
 import fiona
-from shapely.geometry import box, mapping, LineString, MultiLineString, GeometryCollection
+import shapely
+import numpy as np
+from shapely.geometry import box, mapping, shape, LineString, MultiLineString, GeometryCollection
 
 from shapely.ops import linemerge
 import json
 import math
 from rtree import index
+from multiprocessing import Pool
+import pickle
+import tempfile
+import shutil
+import resource
+import time
 
 
 import sys
 sys.path.append('/home/juju/workspace/pyEx/src/')
-from utils.featureutils import load_features
+from utils.featureutils import load_features, iter_features, is_parquet, is_trace_store
+from tile_archive import open_tile_archive_writer
+from tile_encoding import encode_binary_tile, decode_binary_tile, compress, decompress, tile_extension
 
 
 def resolutionise_tile(xmin, ymin, geometry, resolution):
-    if geometry.is_empty:
-        return geometry
-
-#np.round(coords).astype(int)
-    def _reso_x(x):
-        return int(math.floor((x-xmin)/resolution))
-    def _reso_y(y):
-        return int(math.floor((y-ymin)/resolution))
-
-    def _resos(coords):
-        return tuple([_reso_x(coords[0]), _reso_y(coords[1])])
-
-    if geometry.geom_type == 'Point':
-        return type(geometry)(*map(_resos, [geometry.coords[0]]))
-    elif geometry.geom_type in ['LineString', 'LinearRing']:
-        return type(geometry)(list(map(_resos, geometry.coords)))
-    elif geometry.geom_type == 'Polygon':
-        exterior = list(map(_resos, geometry.exterior.coords))
-        interiors = [list(map(_resos, ring.coords)) for ring in geometry.interiors]
-        return type(geometry)(exterior, interiors)
-    elif geometry.geom_type == 'MultiPoint':
-        return type(geometry)([type(geometry.geoms[0])(list(map(_resos, geom.coords))) for geom in geometry.geoms])
-    elif geometry.geom_type == 'MultiLineString':
-        return type(geometry)([type(geometry.geoms[0])(list(map(_resos, geom.coords))) for geom in geometry.geoms])
-    elif geometry.geom_type == 'MultiPolygon':
-        return type(geometry)([
-            type(geometry.geoms[0])(
-                list(map(_resos, geom.exterior.coords)),
-                [list(map(_resos, ring.coords)) for ring in geom.interiors]
-            )
-            for geom in geometry.geoms
-        ])
-    #elif geometry.geom_type == 'GeometryCollection':
-    #    return type(geometry)([resolutionise_tile(xmin, ymin, geom, resolution) for geom in geometry.geoms])
-    else:
-        print(geometry)
-        raise ValueError("Unhandled geometry type: {}".format(geometry.geom_type))
+    """
+    Convert the coordinates of geometries into integer pixel coordinates, relative to the tile origin.
+
+    Parameters:
+    - xmin, ymin: The tile origin. These may be arrays, one value per geometry.
+    - geometry: A shapely geometry, or an array of shapely geometries, of any type.
+    - resolution: The pixel resolution.
+
+    Returns:
+    - The geometry, or array of geometries, in pixel coordinates.
+    """
+
+    # single geometry
+    if not isinstance(geometry, np.ndarray):
+        return resolutionise_tile(xmin, ymin, np.array([geometry], dtype=object), resolution)[0]
+
+    # get all coordinates at once, with the index of their geometry
+    coords, ids = shapely.get_coordinates(geometry, return_index=True)
+
+    # origin of each geometry
+    origins = np.empty((len(geometry), 2))
+    origins[:,0] = xmin
+    origins[:,1] = ymin
+
+    # snap
+    coords = np.floor((coords - origins[ids]) / resolution)
+
+    return shapely.set_coordinates(geometry.copy(), coords)
 
 
 def extract_linear_components_as_lines(geometry):
@@ -106,146 +107,928 @@ def round_geojson_coordinates(geojson):
 
 
 
-def tile_z(input_gpkg_path, output_folder, tile_size=256, resolution=250000, origin_x = 0, origin_y = 0, epsg = "3857"):
+def clip_tile_geometries(geoms, tile_bounds):
+    """
+    Clip geometries to a tile, with a single vectorised rectangle clipping.
+    The geometries lying entirely within the tile are not clipped. The linear components of the clipped geometry
+    collections are kept, as in extract_linear_components_as_lines.
+    Unlike an intersection, the clipping does not split the lines at their self intersections, nor dissolve their
+    overlapping parts. The geometries touching the tile border are clipped with an intersection.
+
+    Parameters:
+    - geoms: The array of geometries.
+    - tile_bounds: The tile bounds (minx, miny, maxx, maxy).
+
+    Returns:
+    - The array of clipped geometries. Some may be empty.
+    """
+    minx, miny, maxx, maxy = tile_bounds
+    b = shapely.bounds(geoms)
+    outside = (b[:,0] < minx) | (b[:,1] < miny) | (b[:,2] > maxx) | (b[:,3] > maxy)
+    geoms = geoms.copy()
+    if not outside.any(): return geoms
+    clipped = shapely.clip_by_rect(geoms[outside], minx, miny, maxx, maxy)
+
+    # clip_by_rect drops the segments lying on the tile border, and returns nothing for the geometries touching the
+    # tile only. The geometries with a segment on the line of a tile edge, and the empty clippings of geometries
+    # intersecting the tile, are clipped with an intersection, as before.
+    coords, ids = shapely.get_coordinates(geoms[outside], return_index=True)
+    c0, c1 = coords[:-1], coords[1:]
+    on_edge = ((c0[:,0] == c1[:,0]) & ((c0[:,0] == minx) | (c0[:,0] == maxx))) | ((c0[:,1] == c1[:,1]) & ((c0[:,1] == miny) | (c0[:,1] == maxy)))
+    border = np.zeros(len(clipped), dtype=bool)
+    border[ids[1:][on_edge & (ids[1:] == ids[:-1])]] = True
+    border |= shapely.is_empty(clipped) & shapely.intersects(geoms[outside], box(*tile_bounds))
+    if border.any(): clipped[border] = _clip_tile_geometries_per_feature(geoms[outside][border], tile_bounds)
+    geoms[outside] = clipped
+
+    # geometry collections
+    collections = np.nonzero((shapely.get_type_id(geoms) == 7) & ~shapely.is_empty(geoms))[0]
+    for i in collections:
+        geom = extract_linear_components_as_lines(geoms[i])
+        geoms[i] = shapely.empty(1)[0] if geom is None else geom
+    return geoms
+
+
+def _clip_tile_geometries_per_feature(geoms, tile_bounds):
+    # the former clipping, feature by feature with a general intersection, for benchmark_clipping
+    tile_bounding_box = box(*tile_bounds)
+    out = []
+    for geom in geoms:
+        geom = geom.intersection(tile_bounding_box)
+        if geom.geom_type == "GeometryCollection" and not geom.is_empty:
+            geom = extract_linear_components_as_lines(geom)
+            if geom is None: geom = GeometryCollection()
+        out.append(geom)
+    return np.array(out, dtype=object)
+
+
+def benchmark_clipping(input_gpkg_path, tile_size=256, resolution=250000, origin_x = 0, origin_y = 0, layer_suffix=""):
+    """
+    Compare the durations of the vectorised clipping of clip_tile_geometries with the former clipping feature by feature,
+    on all the occupied tiles of a zoom level, and check that the clipped geometries cover the same lines.
+    The results are printed.
+    """
+    fs = load_features(input_gpkg_path, layer="linestring"+layer_suffix) + load_features(input_gpkg_path, layer="point"+layer_suffix)
+    tile_size *= resolution
+    tiles = sparse_tiles(fs, tile_size, origin_x, origin_y)
+    geoms = np.array([f["geometry"] for f in fs], dtype=object)
+    print(len(fs), "features,", len(tiles), "tiles,", sum(len(iids) for _, _, iids in tiles), "clippings")
+
+    durations = []
+    results = []
+    for clip in [_clip_tile_geometries_per_feature, clip_tile_geometries]:
+        t = time.perf_counter()
+        results.append([clip(geoms[iids], (origin_x + ti * tile_size, origin_y + tj * tile_size, origin_x + (ti + 1) * tile_size, origin_y + (tj + 1) * tile_size)) for ti, tj, iids in tiles])
+        durations.append(time.perf_counter() - t)
+    print("Per feature:", round(durations[0], 3), "s - vectorised:", round(durations[1], 3), "s - speed-up:", round(durations[0] / durations[1], 1))
+
+    # compare the clipped geometries
+    g0, g1 = np.concatenate(results[0]), np.concatenate(results[1])
+    e0, e1 = shapely.is_empty(g0), shapely.is_empty(g1)
+    both = ~e0 & ~e1
+    print("Clippings empty with one method only:", int((e0 != e1).sum()))
+    # the intersection splits the lines at their self intersections and dissolves their overlapping parts: compare the covered lines
+    tolerance = resolution * 1e-3
+    print("Length covered by one method only, in pixels:", (shapely.length(shapely.difference(g0[both], shapely.buffer(g1[both], tolerance))).sum()
+        + shapely.length(shapely.difference(g1[both], shapely.buffer(g0[both], tolerance))).sum()) / resolution)
+
+
+def tile_features(feature_dict, idx, ti, tj, tile_size, resolution, origin_x = 0, origin_y = 0, epsg = "3857", iids = None, attribute_key = None):
+    """
+    Build the geojson content of a tile.
+
+    Parameters:
+    - feature_dict: The features, indexed by their spatial index id.
+    - idx: The spatial index of the features.
+    - ti, tj: The tile position.
+    - tile_size: The tile size, in meters.
+    - resolution: The resolution, in meters.
+    - iids: The ids of the candidate features of the tile. If None, they are retrieved from the spatial index.
+    - attribute_key: If specified, the features have this property value as id, and no properties: their properties
+      are in an attribute table. See collect_attributes. The features without this property keep their properties,
+      and have no id, so that they cannot be confused with the keys of the table.
+
+    Returns:
+    - The geojson dictionnary of the tile, or None if the tile is empty.
+    """
+
+    # tile bounds
+    tile_minx = origin_x + ti * tile_size
+    tile_maxx = origin_x + (ti + 1) * tile_size
+    tile_miny = origin_y + tj * tile_size
+    tile_maxy = origin_y + (tj + 1) * tile_size
+    tile_bounds = (tile_minx, tile_miny, tile_maxx, tile_maxy)
+
+    # get intersecting features using index
+    if iids is None: iids = list(idx.intersection(tile_bounds))
+
+    # skip if empty
+    if(len(iids)==0): return None
+
+    # handle every feature
+    geojson_dict = {"type":"FeatureCollection", "features": [], "crs":{"type":"name","properties":{"name":"urn:ogc:def:crs:EPSG::"+epsg}}}
+
+    # clip geometries
+    iids = list(iids)
+    geoms = clip_tile_geometries(np.array([feature_dict[iid]["geometry"] for iid in iids], dtype=object), tile_bounds)
+    keep = ~shapely.is_empty(geoms)
+    clipped = [(iid, geom) for iid, geom, k in zip(iids, geoms, keep) if k]
+
+    # resolutionise coordinates of all geometries at once
+    geoms = np.array([geom for _, geom in clipped], dtype=object)
+    geoms = resolutionise_tile(tile_minx, tile_miny, geoms, resolution)
+
+    for (iid, _), geom in zip(clipped, geoms):
+        feature = feature_dict[iid]
+
+        if geom.is_empty: continue
+
+        # to remove duplicate points of linear features
+        #geom = geom.simplify(0)
+        #if geom.is_empty: continue
+
+        # linemerge
+        #try: geom = linemerge(geom)
+        #except: pass
+        #if geom.is_empty: continue
+
+        # to clean polygons
+        # geom = geom.buffer(0)
+
+        #make geojson geometry
+        gjgeom = mapping(geom)
+
+        #int geometry
+        gjgeom = round_geojson_coordinates(gjgeom)
+
+        # features with attributes in an attribute table
+        key = _attribute_key_value(feature, attribute_key)
+        if key is not None:
+            geojson_dict['features'].append({ "type":"Feature", "id":key, "properties":{}, "geometry": gjgeom })
+            continue
+
+        #make geojson feature
+        gjf = { "type":"Feature", "id":str(iid), "properties":{}, "geometry": gjgeom }
+        if attribute_key is not None: del gjf["id"]
+
+        # copy feature properties
+        for prop in feature:
+            if(prop == "geometry"): continue
+            gjf["properties"][prop] = feature[prop]
+
+        #add
+        geojson_dict['features'].append(gjf)
+
+    # no feature
+    if len(geojson_dict['features'])==0: return None
+
+    return geojson_dict
+
+
+# Attribute table: instead of being copied in every tile of every zoom level, the feature properties can be written
+# once into a table, keyed by a feature property such as the trace identifier. The tile features then only have
+# this key as id. The table is a JSON file:
+#   { "key": "identifier", "columns": [column names], "rows": { key value: [values, in the columns order] } }
+# It is saved next to metadata.json, or into the metadata of a tile archive. Only the tile features with an id are
+# joined with the table: the features without key keep their properties, and have no id.
+
+ATTRIBUTE_TABLE_FILE = "attributes.json"
+
+def _attribute_key_value(feature, attribute_key):
+    # the key of a feature in the attribute table, or None
+    if attribute_key is None: return None
+    key = feature.get(attribute_key)
+    if key is None or str(key) == "": return None
+    return str(key)
+
+def collect_attributes(fs, attribute_key, attributes):
+    """
+    Add the properties of some features to an attribute table, if they are not in it already.
+
+    Parameters:
+    - fs: The features.
+    - attribute_key: The property used as key.
+    - attributes: The attribute table to fill, as a dictionnary of the feature properties by key value.
+    """
+    for f in fs:
+        key = _attribute_key_value(f, attribute_key)
+        if key is None or key in attributes: continue
+        attributes[key] = { k: v for k, v in f.items() if k != "geometry" and k != attribute_key }
+
+
+def attribute_table(attributes, attribute_key):
+    """Build the compact JSON attribute table from a dictionnary of the feature properties by key value."""
+    columns = list(dict.fromkeys(c for properties in attributes.values() for c in properties))
+    return { "key": attribute_key, "columns": columns, "rows": { k: [properties.get(c) for c in columns] for k, properties in attributes.items() } }
+
+
+def load_attributes(table):
+    """Return the dictionnary of the feature properties by key value of a JSON attribute table."""
+    return { k: dict(zip(table["columns"], row)) for k, row in table["rows"].items() }
+
+
+def encode_tile(geojson_dict, tile_format="geojson", compression=None):
+    """
+    Encode a tile as bytes.
+
+    Parameters:
+    - tile_format: "geojson", or "bin" for the binary tile format of tile_encoding.
+    - compression: None, "gzip" or "br".
+    """
+    if tile_format == "bin": data = encode_binary_tile(geojson_dict)
+    else: data = json.dumps(geojson_dict, separators=(',', ':')).encode("utf-8")
+    return compress(data, compression)
+
+
+def decode_tile(data, tile_format="geojson", compression=None):
+    """Decode a tile encoded with encode_tile, as a geojson dictionnary."""
+    data = decompress(data, compression)
+    if tile_format == "bin": return decode_binary_tile(data)
+    return json.loads(data)
+
+
+def save_tile(geojson_dict, output_folder, ti, tj, tile_format="geojson", compression=None):
+
+    # output file
+    output_file = os.path.join(output_folder, f"{ti}/{tj}."+tile_extension(tile_format, compression))
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+
+    # save
+    with open(output_file, 'wb') as f:
+        f.write(encode_tile(geojson_dict, tile_format, compression))
+
+
+
+# data shared by the tiling worker processes
+_worker = {}
+
+def _init_tiling_worker(fs, output_folder, tile_size, resolution, origin_x, origin_y, epsg, tile_format, compression, sparse=False, keep=False, attribute_key=None):
+    # rebuild the spatial index the same way as the serial path, so that tiles are identical
+    # no index is needed for sparse tiling
+    idx = None
+    if not sparse:
+        idx = index.Index()
+        for i,f in enumerate(fs): idx.insert(i, f['geometry'].bounds)
+    _worker.update(fs=fs, idx=idx, output_folder=output_folder, tile_size=tile_size, resolution=resolution, origin_x=origin_x, origin_y=origin_y, epsg=epsg, tile_format=tile_format, compression=compression, keep=keep, attribute_key=attribute_key)
+
+def _tile_block(block):
+    # tile a block of tiles, within a worker process
+    # a block is either a (ti_min, ti_max, tj_min, tj_max) tile range, or a list of (ti, tj, iids) tiles with their candidate features
+    # when there is no output folder, the encoded tiles are returned as (ti, tj, data) tuples
+    # with keep, the geojson dictionnaries of the tiles are returned as well, as (ti, tj, data, geojson_dict) tuples
+    if isinstance(block, tuple):
+        (ti_min, ti_max, tj_min, tj_max) = block
+        block = [(ti, tj, None) for ti in range(ti_min, ti_max) for tj in range(tj_min, tj_max)]
+    w = _worker
+    tiles = []
+    for ti, tj, iids in block:
+        geojson_dict = tile_features(w["fs"], w["idx"], ti, tj, w["tile_size"], w["resolution"], w["origin_x"], w["origin_y"], w["epsg"], iids, w["attribute_key"])
+        if geojson_dict is None: continue
+        if w.get("keep"): tiles.append((ti, tj, encode_tile(geojson_dict, w["tile_format"], w["compression"]), geojson_dict))
+        elif w["output_folder"] is None: tiles.append((ti, tj, encode_tile(geojson_dict, w["tile_format"], w["compression"])))
+        else:
+            save_tile(geojson_dict, w["output_folder"], ti, tj, w["tile_format"], w["compression"])
+            tiles.append((ti, tj, None))
+    return tiles
+
+
+def tile_blocks(mintx, maxtx, minty, maxty, block_size=16):
+    """
+    Split a tile range into square blocks of tiles.
+
+    Returns:
+    - A list of (ti_min, ti_max, tj_min, tj_max) tuples.
+    """
+    blocks = []
+    for ti in range(mintx, maxtx, block_size):
+        for tj in range(minty, maxty, block_size):
+            blocks.append((ti, min(ti+block_size, maxtx), tj, min(tj+block_size, maxty)))
+    return blocks
+
+
+
+def tile_range(bounds, tile_size, origin_x = 0, origin_y = 0):
+    """
+    Return the range of the tiles intersecting some bounds, as (mintx, maxtx, minty, maxty), max excluded.
+    The bounds are closed: the tiles they touch are included, as with the spatial index of tile_features.
+    """
+    minx, miny, maxx, maxy = bounds
+    # floor and ceil, not int, for the tiles before the origin
+    mintx = math.ceil((minx-origin_x)/tile_size) -1
+    maxtx = math.floor((maxx-origin_x)/tile_size) +1
+    minty = math.ceil((miny-origin_y)/tile_size) -1
+    maxty = math.floor((maxy-origin_y)/tile_size) +1
+    return mintx, maxtx, minty, maxty
+
+
+def covered_tile_keys(geometry, tile_size, origin_x = 0, origin_y = 0):
+    """
+    Return the keys (ti, tj) of the tiles intersecting a geometry.
+    The tile range of the geometry bounds is recursively split, keeping only the parts intersecting the geometry.
+
+    Parameters:
+    - geometry: The geometry.
+    - tile_size: The tile size, in meters.
+    """
+    if geometry.is_empty: return []
+    mintx, maxtx, minty, maxty = tile_range(geometry.bounds, tile_size, origin_x, origin_y)
+
+    # single tile
+    if maxtx-mintx == 1 and maxty-minty == 1: return [(mintx, minty)]
+
+    shapely.prepare(geometry)
+    keys = []
+    stack = [(mintx, maxtx, minty, maxty)]
+    while stack:
+        ti0, ti1, tj0, tj1 = stack.pop()
+        if not geometry.intersects(box(origin_x + ti0 * tile_size, origin_y + tj0 * tile_size, origin_x + ti1 * tile_size, origin_y + tj1 * tile_size)): continue
+
+        # split the largest side
+        if ti1-ti0 == 1 and tj1-tj0 == 1: keys.append((ti0, tj0))
+        elif ti1-ti0 >= tj1-tj0:
+            tim = (ti0+ti1) // 2
+            stack += [(ti0, tim, tj0, tj1), (tim, ti1, tj0, tj1)]
+        else:
+            tjm = (tj0+tj1) // 2
+            stack += [(ti0, ti1, tj0, tjm), (ti0, ti1, tjm, tj1)]
+    shapely.destroy_prepared(geometry)
+    return keys
+
+
+def sparse_tiles(fs, tile_size, origin_x = 0, origin_y = 0):
+    """
+    Group features by the tiles their geometry intersects.
+
+    Parameters:
+    - fs: The features.
+    - tile_size: The tile size, in meters.
+
+    Returns:
+    - The list of the (ti, tj, iids) occupied tiles, with the ids of their features, sorted by tile key.
+    """
+    tiles = {}
+    for i,f in enumerate(fs):
+        for key in covered_tile_keys(f['geometry'], tile_size, origin_x, origin_y):
+            if key in tiles: tiles[key].append(i)
+            else: tiles[key] = [i]
+    return [(ti, tj, iids) for (ti, tj), iids in sorted(tiles.items())]
+
+
+def get_bounds(input_gpkg_path, layers):
+    # union of the bounds of several layers of a file
+    if is_parquet(input_gpkg_path):
+        from utils.parquetutils import get_bounds_parquet
+        return get_bounds_parquet(input_gpkg_path, layers)
+    if is_trace_store(input_gpkg_path):
+        from utils.tracestoreutils import open_trace_store
+        return open_trace_store(input_gpkg_path).total_bounds()
+    bounds = [fiona.open(input_gpkg_path, layer=layer).bounds for layer in layers]
+    return min(b[0] for b in bounds), min(b[1] for b in bounds), max(b[2] for b in bounds), max(b[3] for b in bounds)
+
+
+def tile_z(input_gpkg_path, output_folder, tile_size=256, resolution=250000, origin_x = 0, origin_y = 0, epsg = "3857", nb_processes=1, block_size=16, layer_suffix="", writer=None, z=None, tile_format="geojson", compression=None, sparse=False, attribute_key=None, attributes=None):
+    """
+    Tile a zoom level.
+
+    Parameters:
+    - sparse: Set to True to handle only the tiles intersecting features, which are computed from the features geometries,
+      instead of all the tiles of the data bounding box.
+    - tile_format: The tile format, "geojson", or "bin" for the binary tile format of tile_encoding.
+    - compression: The tile compression, None, "gzip" or "br".
+    - writer: A tile archive writer (see tile_archive). If specified, tiles are written to it, with zoom level z,
+      instead of the output folder.
+    - attribute_key: If specified, the tile features carry only this property, as id. See tile_features.
+    - attributes: An attribute table to fill with the properties of the features. See collect_attributes.
+    """
 
     # convert tile size from pix to meters
     tile_size *= resolution
 
     # create output folder
-    os.makedirs(output_folder, exist_ok=True)
+    if writer is None: os.makedirs(output_folder, exist_ok=True)
 
     # input data bounding box
-    src = fiona.open(input_gpkg_path)
-    minx, miny, maxx, maxy = src.bounds
+    bounds = get_bounds(input_gpkg_path, ["linestring"+layer_suffix, "point"+layer_suffix])
 
     # tiles range
-    mintx = int((minx-origin_x)/tile_size)
-    maxtx = int((maxx-origin_x)/tile_size) +1
-    minty = int((miny-origin_y)/tile_size)
-    maxty = int((maxy-origin_y)/tile_size) +1
+    mintx, maxtx, minty, maxty = tile_range(bounds, tile_size, origin_x, origin_y)
 
     # load input data
     print("Load data from", input_gpkg_path)
-    fs = load_features(input_gpkg_path, layer="linestring") + load_features(input_gpkg_path, layer="point")
+    fs = load_features(input_gpkg_path, layer="linestring"+layer_suffix) + load_features(input_gpkg_path, layer="point"+layer_suffix)
     print(len(fs))
+    if attributes is not None: collect_attributes(fs, attribute_key, attributes)
+
+    # occupied tiles, for sparse tiling
+    tiles = None
+    if sparse:
+        tiles = sparse_tiles(fs, tile_size, origin_x, origin_y)
+        print(len(tiles), "occupied tiles")
+
+    # parallel tiling: split the tiles into blocks, handled by a pool of processes
+    if nb_processes > 1:
+        if sparse: blocks = [tiles[i:i+block_size*block_size] for i in range(0, len(tiles), block_size*block_size)]
+        else: blocks = tile_blocks(mintx, maxtx, minty, maxty, block_size)
+        print("Tiling", len(blocks), "blocks with", nb_processes, "processes")
+        nb = 0
+        with Pool(nb_processes, initializer=_init_tiling_worker, initargs=(fs, None if writer else output_folder, tile_size, resolution, origin_x, origin_y, epsg, tile_format, compression, sparse, False, attribute_key)) as pool:
+            for tiles in pool.imap_unordered(_tile_block, blocks):
+                nb += len(tiles)
+                if writer is None: continue
+                for ti, tj, data in tiles: writer.write(z, ti, tj, data)
+        print(nb, "tiles")
+        return
 
     # make spatial index and dictionary
-    idx = index.Index()
+    idx = None
     feature_dict = {}
+    if not sparse: idx = index.Index()
     for i,f in enumerate(fs):
-        idx.insert(i, f['geometry'].bounds)
+        if not sparse: idx.insert(i, f['geometry'].bounds)
         feature_dict[i] = f
 
+    # tiles to handle
+    if not sparse: tiles = ((ti, tj, None) for ti in range(mintx, maxtx) for tj in range(minty, maxty))
+
     # handle tiles
-    for ti in range(mintx, maxtx):
-        for tj in range(minty, maxty):
+    for ti, tj, iids in tiles:
+        geojson_dict = tile_features(feature_dict, idx, ti, tj, tile_size, resolution, origin_x, origin_y, epsg, iids, attribute_key)
+        if geojson_dict is None: continue
+        if writer is None: save_tile(geojson_dict, output_folder, ti, tj, tile_format, compression)
+        else: writer.write(z, ti, tj, encode_tile(geojson_dict, tile_format, compression))
+
+
+
+# Pyramid tiling: the finest zoom level is tiled from the feature geometries, and each coarser tile is then built
+# from its four child tiles, whose geometries are already clipped and in pixel coordinates. The pixel (px, py) of
+# the child (a, b) of a tile (a, b in {0,1}) is the pixel ((a*tile_size + px) // 2, (b*tile_size + py) // 2) of
+# its parent, which is the pixel obtained by snapping the original coordinates at the coarser resolution.
+# The parts of a feature in the four children are snapped, merged, simplified by one pixel, and cleaned of
+# their degenerate parts. Lines collapsing into a single pixel become points.
+
+
+def parent_tile_features(children, tile_size, epsg = "3857", tolerance = 1):
+    """
+    Build the geojson content of a tile from the geojson contents of its child tiles, at the next finer zoom level.
+
+    Parameters:
+    - children: The list of (a, b, geojson_dict) child tiles, where (a, b) is the child position in the tile: (0,0) for
+      the bottom left child, (1,1) for the top right one.
+    - tile_size: The tile size, in pixels.
+    - tolerance: The simplification tolerance, in pixels.
 
-            # tile bounds
-            tile_minx = origin_x + ti * tile_size
-            tile_maxx = origin_x + (ti + 1) * tile_size
-            tile_miny = origin_y + tj * tile_size
-            tile_maxy = origin_y + (tj + 1) * tile_size
-            tile_bounds = (tile_minx, tile_miny, tile_maxx, tile_maxy)
-            tile_bounding_box = box(tile_minx, tile_miny, tile_maxx, tile_maxy)
+    Returns:
+    - The geojson dictionnary of the tile, or None if the tile is empty.
+    """
+
+    # gather the parts of each feature, converted into the tile pixel coordinates
+    # the features without id (see tile_features) cannot be matched between the children: each of them is kept on
+    # its own, under a (a, b, index) key
+    parts = {}
+    properties = {}
+    for a, b, geojson_dict in children:
+        geoms = np.array([shape(f["geometry"]) for f in geojson_dict["features"]], dtype=object)
+        geoms = shapely.transform(geoms, lambda c: np.floor((c + (a * tile_size, b * tile_size)) / 2))
+        for i, (f, geom) in enumerate(zip(geojson_dict["features"], geoms)):
+            iid = f["id"] if "id" in f else (a, b, i)
+            parts.setdefault(iid, []).append(geom)
+            properties[iid] = f["properties"]
+
+    # merge the parts of each feature: its lines, or its first point if it has no line
+    # (a point feature may be in several children, and a line may touch a child at a single point)
+    # ids are sorted by length first, so that numeric ids are in numeric order, and the features without id come last
+    iids = sorted(parts.keys(), key=lambda iid: (1, iid) if isinstance(iid, tuple) else (0, (len(iid), iid)))
+    geoms = []
+    for iid in iids:
+        ls = [l for g in parts[iid] for l in shapely.get_parts(g) if l.geom_type == "LineString"]
+        if len(ls) == 0: geoms.append(parts[iid][0])
+        elif len(ls) == 1: geoms.append(ls[0])
+        else: geoms.append(MultiLineString(ls))
+    geoms = np.array(geoms, dtype=object)
 
-            # get intersecting features using index
-            iids = list(idx.intersection(tile_bounds))
+    # merge the parts of the lines, without noding them: the parts of a trace cut at a tile boundary share their end
+    # pixel, and keep the trace direction. Then simplify them.
+    lines = shapely.get_dimensions(geoms) == 1
+    unsimplified = geoms.copy()
+    geoms[lines] = shapely.remove_repeated_points(shapely.simplify(shapely.line_merge(geoms[lines], directed=True), tolerance))
 
-            # skip if empty
-            if(len(iids)==0): continue
+    geojson_dict = {"type":"FeatureCollection", "features": [], "crs":{"type":"name","properties":{"name":"urn:ogc:def:crs:EPSG::"+epsg}}}
+    for iid, geom, is_line, geom_ in zip(iids, geoms, lines, unsimplified):
 
-            # handle every feature
-            geojson_dict = {"type":"FeatureCollection", "features": [], "crs":{"type":"name","properties":{"name":"urn:ogc:def:crs:EPSG::"+epsg}}}
+        if is_line:
+            # drop the degenerate parts
+            ls = [l for l in shapely.get_parts(geom) if l.length > 0]
+            if len(ls) == 0: geom = shapely.get_point(shapely.get_parts(geom_)[0], 0)
+            elif len(ls) == 1: geom = ls[0]
+            else: geom = MultiLineString(ls)
 
-            for iid in iids:
-                feature = feature_dict[iid]
+        gjgeom = round_geojson_coordinates(mapping(geom))
+        gjf = { "type":"Feature", "id":iid, "properties":properties[iid], "geometry": gjgeom }
+        if isinstance(iid, tuple): del gjf["id"]
+        geojson_dict['features'].append(gjf)
 
-                #get geometry
-                geom = feature["geometry"]
+    if len(geojson_dict['features'])==0: return None
+    return geojson_dict
 
-                # intersect geometry
-                geom = geom.intersection(tile_bounding_box)
-                if geom.is_empty: continue
 
-                # TODO move that to simplify ?
+def _init_pyramid_worker(tile_size, epsg, tile_format, compression, tolerance):
+    _worker.update(tile_size=tile_size, epsg=epsg, tile_format=tile_format, compression=compression, tolerance=tolerance)
 
-                # simplify
-                #geom = geom.simplify(simplify_f * resolution)
-                #if geom.is_empty: continue
+def _build_parent_block(block):
+    # build a block of parent tiles, within a worker process, as (ti, tj, data, geojson_dict) tuples
+    w = _worker
+    tiles = []
+    for ti, tj, children in block:
+        geojson_dict = parent_tile_features(children, w["tile_size"], w["epsg"], w["tolerance"])
+        if geojson_dict is None: continue
+        tiles.append((ti, tj, encode_tile(geojson_dict, w["tile_format"], w["compression"]), geojson_dict))
+    return tiles
 
-                #
-                if geom.geom_type == "GeometryCollection":
-                    geom = extract_linear_components_as_lines(geom)
 
-                # resolutionise coordinates
-                #print(geom.geom_type)
-                geom = resolutionise_tile(tile_minx, tile_miny, geom, resolution)
-                if geom.is_empty: continue
+def tile_pyramid(input_gpkg_path, output_folder, z_min = 1, z_max = 10, tile_size = 256, resolution_0 = 250000, origin_x = 0, origin_y = 0, epsg = "3857", nb_processes = 1, block_size = 16, layer_suffix = "", writer = None, tile_format = "geojson", compression = None, tolerance = 1, attribute_key = None, attributes = None):
+    """
+    Tile several zoom levels bottom-up: the zoom level z_max is tiled from the features, as tile_z with sparse tiling,
+    and the tiles of each coarser zoom level are then built from their four children (see parent_tile_features).
+    The features are loaded, indexed and clipped only once, and the work decreases with the zoom level.
+    The tiles of a zoom level are kept in memory until the next coarser level is built.
+    The coarser tiles are close to, but not the same as the ones of tile_z: their geometries are simplified from
+    the finer tiles and not from the features, and are somewhat more detailed.
+
+    Parameters:
+    - input_gpkg_path: The features file, for the zoom level z_max.
+    - output_folder: The output folder, into which the {z}/{ti}/{tj} tiles are written. Ignored if a writer is specified.
+    - nb_processes: The number of processes. The tiles of a zoom level are built in parallel, by blocks of
+      block_size x block_size tiles.
+    - tolerance: The simplification tolerance of the coarser zoom levels, in pixels.
+    See tile_z for the other parameters.
+    - attribute_key, attributes: See tile_z.
+    """
 
-                # to remove duplicate points of linear features
-                #geom = geom.simplify(0)
-                #if geom.is_empty: continue
+    # tile the finest zoom level
+    print("Tiling - zoom level", z_max)
+    resolution = resolution_0 / math.pow(2, z_max)
+    print("Load data from", input_gpkg_path)
+    fs = load_features(input_gpkg_path, layer="linestring"+layer_suffix) + load_features(input_gpkg_path, layer="point"+layer_suffix)
+    print(len(fs))
+    if attributes is not None: collect_attributes(fs, attribute_key, attributes)
+    tiles = sparse_tiles(fs, tile_size * resolution, origin_x, origin_y)
+    blocks = [tiles[i:i+block_size*block_size] for i in range(0, len(tiles), block_size*block_size)]
+    initargs = (fs, None, tile_size * resolution, resolution, origin_x, origin_y, epsg, tile_format, compression, True, True, attribute_key)
+    z = z_max
+    build, init = _tile_block, _init_tiling_worker
 
-                # linemerge
-                #try: geom = linemerge(geom)
-                #except: pass
-                #if geom.is_empty: continue
+    while True:
 
-                # to clean polygons
-                # geom = geom.buffer(0)
+        # build and save the tiles of the zoom level
+        level = {}
+        if nb_processes > 1:
+            with Pool(nb_processes, initializer=init, initargs=initargs) as pool: results = list(pool.imap_unordered(build, blocks))
+        else:
+            init(*initargs)
+            results = map(build, blocks)
+        for block_tiles in results:
+            for ti, tj, data, geojson_dict in block_tiles:
+                level[(ti, tj)] = geojson_dict
+                if writer is not None: writer.write(z, ti, tj, data)
+                else:
+                    output_file = os.path.join(output_folder, f"{z}/{ti}/{tj}."+tile_extension(tile_format, compression))
+                    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+                    with open(output_file, 'wb') as f: f.write(data)
+        print(len(level), "tiles")
 
-                #make geojson geometry
-                gjgeom = mapping(geom)
+        if z == z_min: break
 
-                #int geometry
-                gjgeom = round_geojson_coordinates(gjgeom)
+        # group the tiles by parent tile
+        z -= 1
+        print("Tiling - zoom level", z)
+        parents = {}
+        for (ti, tj), geojson_dict in sorted(level.items()):
+            parents.setdefault((ti // 2, tj // 2), []).append((ti % 2, tj % 2, geojson_dict))
+        tiles = [(ti, tj, children) for (ti, tj), children in sorted(parents.items())]
+        blocks = [tiles[i:i+block_size*block_size] for i in range(0, len(tiles), block_size*block_size)]
+        initargs = (tile_size, epsg, tile_format, compression, tolerance)
+        build, init = _build_parent_block, _init_pyramid_worker
 
-                #make geojson feature
-                gjf = { "type":"Feature", "id":str(iid), "properties":{}, "geometry": gjgeom }
 
-                # copy feature properties
-                for prop in feature:
-                    if(prop == "geometry"): continue
-                    gjf["properties"][prop] = feature[prop]
+def _flush_buckets(buffers, bucket_folder):
+    # append the buffered features to their bucket files
+    for (pi, pj), data in buffers.items():
+        with open(os.path.join(bucket_folder, f"{pi}_{pj}.pkl"), 'ab') as f:
+            f.write(b"".join(data))
+    buffers.clear()
 
-                #add
-                geojson_dict['features'].append(gjf)
 
-            # no feature
-            if len(geojson_dict['features'])==0: continue
+def _init_bucket_worker(output_folder, tile_size, resolution, origin_x, origin_y, epsg, tile_format, compression, partition_size, attribute_key=None):
+    _worker.update(output_folder=output_folder, tile_size=tile_size, resolution=resolution, origin_x=origin_x, origin_y=origin_y, epsg=epsg, tile_format=tile_format, compression=compression, partition_size=partition_size, attribute_key=attribute_key)
 
-            # output file
-            output_file = os.path.join(output_folder, f"{ti}/{tj}.geojson")
-            os.makedirs(os.path.dirname(output_file), exist_ok=True)
+def _tile_bucket(bucket):
+    # tile the tiles of a partition, from the features of its bucket file
+    # when there is no output folder, the encoded tiles are returned as (ti, tj, data) tuples
+    (bucket_file, pi, pj) = bucket
+    w = _worker
 
-            # save
-            with open(output_file, 'w') as f:
-                json.dump(geojson_dict, f, separators=(',', ':'))
+    # load bucket features, grouped by tile
+    fs = {}
+    tiles = {}
+    with open(bucket_file, 'rb') as f:
+        while True:
+            try: i, feature = pickle.load(f)
+            except EOFError: break
+            fs[i] = feature
+            # the tiles of the partition intersecting the feature, computed when spilling
+            for key in pickle.load(f):
+                if key in tiles: tiles[key].append(i)
+                else: tiles[key] = [i]
 
+    out = []
+    for (ti, tj), iids in sorted(tiles.items()):
+        geojson_dict = tile_features(fs, None, ti, tj, w["tile_size"], w["resolution"], w["origin_x"], w["origin_y"], w["epsg"], iids, w["attribute_key"])
+        if geojson_dict is None: continue
+        if w["output_folder"] is None: out.append((ti, tj, encode_tile(geojson_dict, w["tile_format"], w["compression"])))
+        else:
+            save_tile(geojson_dict, w["output_folder"], ti, tj, w["tile_format"], w["compression"])
+            out.append((ti, tj, None))
+    return out
 
 
-# for several zoom levels
-def tile(input_gpkg_path_fun, output_folder,z_min = 1, z_max = 10, tile_size = 256, resolution_0 = 250000, origin_x = 0, origin_y = 0, epsg = "3857"):
+def tile_z_out_of_core(input_gpkg_path, output_folder, tile_size=256, resolution=250000, origin_x = 0, origin_y = 0, epsg = "3857", nb_processes=1, layer_suffix="", writer=None, z=None, tile_format="geojson", compression=None, memory_budget_mb=512, partition_size=32, bucket_folder=None, attribute_key=None, attributes=None):
+    """
+    Tile a zoom level with bounded memory.
+    The features are streamed from the input file and spilled into buckets on disk, one bucket per partition of
+    partition_size x partition_size tiles. The buckets are then tiled one by one, possibly in parallel.
+    The produced tiles are the same as with tile_z. The peak memory usage is reported at the end.
+
+    Parameters:
+    - memory_budget_mb: The maximum size of the features buffered before being spilled to the buckets, in MB.
+      The features of a bucket must also fit in memory: use a smaller partition_size if needed.
+    - partition_size: The partition size, in number of tiles.
+    - bucket_folder: The folder of the bucket files. By default, a temporary folder which is removed at the end.
+    See tile_z for the other parameters.
+    """
+
+    # convert tile size from pix to meters
+    tile_size *= resolution
 
     # create output folder
-    os.makedirs(output_folder, exist_ok=True)
-
-    # save metadata.json file
-    with open(os.path.join(output_folder, "metadata.json"), 'w') as json_file:
-        #
-        metadata = {
-            "origin_x" : origin_x,
-            "origin_y" : origin_y,
-            "tile_size" : tile_size,
-            "resolution_0" : resolution_0,
-            "z_min" : z_min,
-            "z_max" : z_max
-        }
-        json.dump(metadata, json_file, indent=3)
-
-    # tile for all zoom levels
-    for z in range(z_min, z_max+1):
-        print("Tiling - zoom level", z)
+    if writer is None: os.makedirs(output_folder, exist_ok=True)
+
+    # bucket folder
+    remove_bucket_folder = bucket_folder is None
+    if bucket_folder is None: bucket_folder = tempfile.mkdtemp(prefix="buckets_")
+    os.makedirs(bucket_folder, exist_ok=True)
+
+    # stream features into buckets
+    # features are numbered as with tile_z, to produce the same tiles
+    print("Spill data from", input_gpkg_path, "into buckets")
+    buffers = {}
+    buffered = 0
+    i = 0
+    for layer in ["linestring"+layer_suffix, "point"+layer_suffix]:
+        for feature in iter_features(input_gpkg_path, layer=layer):
+            if attributes is not None: collect_attributes([feature], attribute_key, attributes)
+            data = pickle.dumps((i, feature), protocol=pickle.HIGHEST_PROTOCOL)
+            # the partition of a tile is computed with floor divisions, as the tile keys
+            partitions = {}
+            for key in covered_tile_keys(feature['geometry'], tile_size, origin_x, origin_y):
+                partitions.setdefault((key[0] // partition_size, key[1] // partition_size), []).append(key)
+            # the features are spilled with the keys of their tiles in the partition
+            for p, keys in partitions.items():
+                d = data + pickle.dumps(keys, protocol=pickle.HIGHEST_PROTOCOL)
+                if p in buffers: buffers[p].append(d)
+                else: buffers[p] = [d]
+                buffered += len(d)
+            i += 1
+            if buffered > memory_budget_mb * 1024 * 1024:
+                _flush_buckets(buffers, bucket_folder)
+                buffered = 0
+    _flush_buckets(buffers, bucket_folder)
+    print(i)
+
+    # tile buckets
+    buckets = []
+    for file in sorted(os.listdir(bucket_folder)):
+        pi, pj = os.path.splitext(file)[0].split("_")
+        buckets.append((os.path.join(bucket_folder, file), int(pi), int(pj)))
+    print("Tiling", len(buckets), "buckets")
+
+    initargs = (None if writer else output_folder, tile_size, resolution, origin_x, origin_y, epsg, tile_format, compression, partition_size, attribute_key)
+    nb = 0
+    def handle(tiles):
+        if writer is not None:
+            for ti, tj, data in tiles: writer.write(z, ti, tj, data)
+        return len(tiles)
+
+    if nb_processes > 1:
+        with Pool(nb_processes, initializer=_init_bucket_worker, initargs=initargs) as pool:
+            for tiles in pool.imap_unordered(_tile_bucket, buckets): nb += handle(tiles)
+    else:
+        _init_bucket_worker(*initargs)
+        for bucket in buckets: nb += handle(_tile_bucket(bucket))
+    print(nb, "tiles")
+
+    if remove_bucket_folder: shutil.rmtree(bucket_folder)
+
+    # report peak memory usage, in MB
+    print("Peak RSS:", round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024), "MB", "- workers:", round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024), "MB")
+
+
+
+def tile_keys(bounds, tile_size, origin_x = 0, origin_y = 0):
+    """
+    Return the keys (ti, tj) of the tiles intersecting some bounds.
+
+    Parameters:
+    - bounds: The bounds (minx, miny, maxx, maxy).
+    - tile_size: The tile size, in meters.
+    """
+    mintx, maxtx, minty, maxty = tile_range(bounds, tile_size, origin_x, origin_y)
+    return [(ti, tj) for ti in range(mintx, maxtx) for tj in range(minty, maxty)]
+
+
+def retile_z(input_gpkg_path, output_folder, changed_bounds, tile_size=256, resolution=250000, origin_x = 0, origin_y = 0, epsg = "3857", layer_suffix="", tile_format="geojson", compression=None, attribute_key=None, attributes=None, replaced_keys=None):
+    """
+    Regenerate the tiles of a zoom level which are affected by some changes.
+    Tiles which became empty are deleted.
+
+    Parameters:
+    - changed_bounds: The list of the bounds of the changed (added, removed or modified) features.
+    - attribute_key, attributes: See tile_z. The attribute table is filled with the properties of the loaded features.
+    - replaced_keys: If specified, a set to fill with the feature ids of the tiles before their regeneration.
+    """
+
+    # convert tile size from pix to meters
+    tile_size *= resolution
+
+    done = set()
+    nb = 0
+    for bounds in changed_bounds:
+
+        # expand the bounds, since generalised geometries may be moved by up to the resolution
+        bounds = (bounds[0]-resolution, bounds[1]-resolution, bounds[2]+resolution, bounds[3]+resolution)
+
+        # affected tiles, not handled yet
+        keys = [k for k in tile_keys(bounds, tile_size, origin_x, origin_y) if k not in done]
+        if len(keys) == 0: continue
+
+        # load the features intersecting the affected tiles
+        tis = [k[0] for k in keys]
+        tjs = [k[1] for k in keys]
+        bbox = (origin_x + min(tis) * tile_size, origin_y + min(tjs) * tile_size, origin_x + (max(tis)+1) * tile_size, origin_y + (max(tjs)+1) * tile_size)
+        fs = load_features(input_gpkg_path, bbox=bbox, layer="linestring"+layer_suffix) + load_features(input_gpkg_path, bbox=bbox, layer="point"+layer_suffix)
+        if attributes is not None: collect_attributes(fs, attribute_key, attributes)
+
+        # make spatial index and dictionary
+        idx = index.Index()
+        feature_dict = {}
+        for i,f in enumerate(fs):
+            idx.insert(i, f['geometry'].bounds)
+            feature_dict[i] = f
+
+        # regenerate the tiles
+        for ti, tj in keys:
+            done.add((ti, tj))
+            nb += 1
+            output_file = os.path.join(output_folder, f"{ti}/{tj}."+tile_extension(tile_format, compression))
+
+            # ids of the previous tile features
+            if replaced_keys is not None and os.path.exists(output_file):
+                with open(output_file, 'rb') as f:
+                    replaced_keys.update(gjf["id"] for gjf in decode_tile(f.read(), tile_format, compression)["features"] if gjf.get("id"))
+
+            geojson_dict = tile_features(feature_dict, idx, ti, tj, tile_size, resolution, origin_x, origin_y, epsg, attribute_key=attribute_key)
+            if geojson_dict is not None:
+                save_tile(geojson_dict, output_folder, ti, tj, tile_format, compression)
+                continue
+
+            # remove empty tile
+            if os.path.exists(output_file): os.remove(output_file)
+
+    print(nb, "tiles regenerated")
+
+
+def retile(input_gpkg_path_fun, output_folder, changed_bounds, epsg = "3857", layer_suffix_fun = None):
+    """
+    Regenerate the tiles affected by some changes, for all zoom levels of a tiling made with the tile function.
+    The tiling parameters are read from its metadata.json file.
+
+    Parameters:
+    - changed_bounds: The list of the bounds of the changed (added, removed or modified) features,
+      for example as returned by create_geopackage_from_gpx.
+    The attribute table, if any, is updated with the properties of the features of the regenerated tiles.
+    The rows of the features which were in the regenerated tiles and are in none of them anymore are removed.
+    """
+
+    # load tiling metadata
+    with open(os.path.join(output_folder, "metadata.json"), 'r') as json_file:
+        metadata = json.load(json_file)
+
+    # load attribute table
+    # the rows of the features of the regenerated tiles are replaced
+    attribute_key = metadata.get("attribute_key")
+    attributes = replaced_keys = None
+    if attribute_key is not None:
+        with open(os.path.join(output_folder, ATTRIBUTE_TABLE_FILE), 'r') as json_file:
+            previous = load_attributes(json.load(json_file))
+        attributes = {}
+        replaced_keys = set()
+
+    for z in range(metadata["z_min"], metadata["z_max"]+1):
+        print("Retiling - zoom level", z)
         d = math.pow(2, z)
-        tile_z(input_gpkg_path_fun(z), output_folder+str(z)+"/", tile_size, resolution_0 / d, origin_x, origin_y, epsg)
+        retile_z(input_gpkg_path_fun(z), output_folder+str(z)+"/", changed_bounds, metadata["tile_size"], metadata["resolution_0"] / d, metadata["origin_x"], metadata["origin_y"], epsg, layer_suffix = layer_suffix_fun(z) if layer_suffix_fun else "", tile_format = metadata.get("tile_format", "geojson"), compression = metadata.get("compression"), attribute_key = attribute_key, attributes = attributes, replaced_keys = replaced_keys)
+
+    # save attribute table
+    # the features of the regenerated tiles which are not loaded anymore are removed: a feature is in the same tiles
+    # as before, unless it changed, and then all its previous and new tiles are regenerated
+    if attribute_key is not None:
+        removed = replaced_keys - set(attributes)
+        for key in removed: del previous[key]
+        print(len(removed), "rows removed from the attribute table")
+        previous.update(attributes)
+        with open(os.path.join(output_folder, ATTRIBUTE_TABLE_FILE), 'w') as json_file:
+            json.dump(attribute_table(previous, attribute_key), json_file, separators=(',', ':'))
+
+
+
+# for several zoom levels
+def tile(input_gpkg_path_fun, output_folder,z_min = 1, z_max = 10, tile_size = 256, resolution_0 = 250000, origin_x = 0, origin_y = 0, epsg = "3857", nb_processes = 1, layer_suffix_fun = None, archive_file = None, tile_format = "geojson", compression = None, sparse = False, memory_budget_mb = None, out_of_core_z_min = 0, partition_size = 32, pyramid = False, attribute_key = None):
+    """
+    Tile several zoom levels, into a {z}/{ti}/{tj}.geojson folder structure with a metadata.json file.
+
+    Parameters:
+    - tile_format: The tile format, "geojson", or "bin" for the binary tile format of tile_encoding.
+      Binary tiles files have the ".bin" extension.
+    - compression: The tile compression, None, "gzip" or "br". The compression is added to the tile file extension.
+    - sparse: Set to True to handle only the tiles intersecting features. See tile_z.
+    - memory_budget_mb: If specified, the zoom levels from out_of_core_z_min are tiled with bounded memory,
+      with this memory budget and partition_size. See tile_z_out_of_core.
+    - archive_file: If specified, the tiles and metadata are written into this single tile archive file instead of the
+      output folder. Use a '.mbtiles' extension for a MBTiles file. See tile_archive.
+    - pyramid: Set to True to tile only the zoom level z_max from its features, and to build the coarser zoom levels
+      from it, bottom-up. See tile_pyramid.
+    - attribute_key: If specified, for example "identifier", the feature properties are written once, for all zoom
+      levels, into an attributes.json table keyed by this property, and the tile features carry only its value, as id.
+      With an archive file, the table is in the archive metadata, as "attributes".
+    """
+
+    metadata = {
+        "origin_x" : origin_x,
+        "origin_y" : origin_y,
+        "tile_size" : tile_size,
+        "resolution_0" : resolution_0,
+        "z_min" : z_min,
+        "z_max" : z_max,
+        "tile_format" : tile_format,
+        "compression" : compression
+    }
+    attributes = None
+    if attribute_key is not None:
+        metadata["attribute_key"] = attribute_key
+        if not archive_file: metadata["attribute_table"] = ATTRIBUTE_TABLE_FILE
+        attributes = {}
+
+    writer = None
+    if archive_file:
+        writer = open_tile_archive_writer(archive_file)
+    else:
+        # create output folder
+        os.makedirs(output_folder, exist_ok=True)
+
+        # save metadata.json file
+        with open(os.path.join(output_folder, "metadata.json"), 'w') as json_file:
+            json.dump(metadata, json_file, indent=3)
+
+    try:
+        # tile bottom-up
+        if pyramid:
+            tile_pyramid(input_gpkg_path_fun(z_max), output_folder, z_min, z_max, tile_size, resolution_0, origin_x, origin_y, epsg, nb_processes=nb_processes, layer_suffix=layer_suffix_fun(z_max) if layer_suffix_fun else "", writer=writer, tile_format=tile_format, compression=compression, attribute_key=attribute_key, attributes=attributes)
+
+        # tile for all zoom levels
+        else:
+            for z in range(z_min, z_max+1):
+                print("Tiling - zoom level", z)
+                d = math.pow(2, z)
+                layer_suffix = layer_suffix_fun(z) if layer_suffix_fun else ""
+                output_folder_z = output_folder+str(z)+"/" if output_folder else None
+                if memory_budget_mb and z >= out_of_core_z_min:
+                    tile_z_out_of_core(input_gpkg_path_fun(z), output_folder_z, tile_size, resolution_0 / d, origin_x, origin_y, epsg, nb_processes=nb_processes, layer_suffix=layer_suffix, writer=writer, z=z, tile_format=tile_format, compression=compression, memory_budget_mb=memory_budget_mb, partition_size=partition_size, attribute_key=attribute_key, attributes=attributes)
+                else:
+                    tile_z(input_gpkg_path_fun(z), output_folder_z, tile_size, resolution_0 / d, origin_x, origin_y, epsg, nb_processes=nb_processes, layer_suffix=layer_suffix, writer=writer, z=z, tile_format=tile_format, compression=compression, sparse=sparse, attribute_key=attribute_key, attributes=attributes)
+
+        _save_attributes(attributes, attribute_key, output_folder, writer, metadata)
+    except:
+        # do not leave an incomplete tile archive
+        if writer: writer.abort()
+        raise
+    if writer: writer.close(metadata)
+
 
+def _save_attributes(attributes, attribute_key, output_folder, writer, metadata):
+    # save the attribute table, if any. With a tile archive, it is added to the metadata.
+    if attributes is not None:
+        table = attribute_table(attributes, attribute_key)
+        print(len(table["rows"]), "rows in the attribute table")
+        if writer: metadata["attributes"] = table
+        else:
+            with open(os.path.join(output_folder, ATTRIBUTE_TABLE_FILE), 'w') as json_file:
+                json.dump(table, json_file, separators=(',', ':'))
@@ -0,0 +1,124 @@
+import os
+import gzip
+import numpy as np
+from lxml import etree
+from fit_reader import read_fit_records
+from gpx_reader import read_gpx_segments, parse_time
+
+
+# Readers of the track files of the various formats (GPX, TCX, FIT), decoded in a single pass into the
+# same representation as gpx_reader.read_gpx_segments: a list of (lon, lat, time) tuples of arrays, one per track segment.
+# Gzipped files (.gpx.gz, .tcx.gz, .fit.gz) are decompressed as a stream, while they are parsed, without intermediate file.
+
+TRACK_FORMATS = ["gpx", "tcx", "fit"]
+
+
+def _segment(lons, lats, times):
+    return np.array(lons, dtype=float), np.array(lats, dtype=float), np.array(times, dtype='datetime64[s]')
+
+
+def read_tcx_segments(source, start_time = False):
+    """
+    Read the laps of a TCX file as track segments. Track points without position are ignored.
+
+    Parameters:
+    - source: The TCX file path, or a file object.
+    - start_time: Set to True to return also the time of the first track point, even without position,
+      as a naive UTC datetime, or None.
+    """
+    if isinstance(source, str):
+        with open(source, 'rb') as f: content = f.read()
+    else: content = source.read()
+    # some TCX files start with blank characters before the XML declaration
+    tree = etree.fromstring(content.strip())
+
+    segments = []
+    for lap in tree.iterfind('.//{*}Activity/{*}Lap'):
+        lons, lats, times = [], [], []
+        for trackpoint in lap.iterfind('{*}Track/{*}Trackpoint'):
+            pos = trackpoint.find('{*}Position')
+            if pos is None: continue
+            lats.append(float(pos.findtext('{*}LatitudeDegrees')))
+            lons.append(float(pos.findtext('{*}LongitudeDegrees')))
+            times.append(parse_time(trackpoint.findtext('{*}Time')))
+        segments.append(_segment(lons, lats, times))
+    if not start_time: return segments
+    time = tree.findtext('.//{*}Track/{*}Trackpoint/{*}Time')
+    return segments, parse_time(time) if time else None
+
+
+def read_fit_segments(source, start_time = False):
+    """
+    Read the records of a FIT file as a single track segment. Records without position or time are ignored.
+
+    Parameters:
+    - source: The FIT file path, or a file object.
+    - start_time: Set to True to return also the time of the first record, even without position,
+      as a naive UTC datetime, or None.
+    """
+    time, lat, lon = read_fit_records(source)
+    valid = ~np.isnat(time) & ~np.isnan(lat) & ~np.isnan(lon)
+    segments = [(lon[valid], lat[valid], time[valid])]
+    if not start_time: return segments
+    times = time[~np.isnat(time)]
+    return segments, times[0].astype(object) if len(times) > 0 else None
+
+
+def track_format(file_name):
+    """Return the track format of a file, from its extension, or None if it is not a track file. Gzipped files have the format of their content."""
+    if file_name.lower().endswith(".gz"): file_name = file_name[:-3]
+    extension = file_name.rsplit('.', 1)[-1].lower()
+    return extension if extension in TRACK_FORMATS else None
+
+
+def track_name(file_name):
+    """Return the name of a track file without its extensions, for example 'abc' for 'abc.gpx' or 'abc.fit.gz'."""
+    if file_name.lower().endswith(".gz"): file_name = file_name[:-3]
+    return os.path.splitext(file_name)[0]
+
+
+def open_track_file(file_path):
+    """Open a track file for reading, as a binary file object. Gzipped files are decompressed on the fly."""
+    if file_path.lower().endswith(".gz"): return gzip.open(file_path, 'rb')
+    return open(file_path, 'rb')
+
+
+def read_track_segments(file_path):
+    """
+    Read the track segments of a GPX, TCX or FIT file, possibly gzipped, depending on its extension.
+
+    Returns:
+    - The list of track segments, each as a (lon, lat, time) tuple of arrays. See gpx_reader.read_gpx_segments.
+    """
+    format = track_format(file_path)
+    if format is None: raise ValueError("Unexpected file format: " + os.path.basename(file_path))
+    with open_track_file(file_path) as f:
+        if format == "gpx": return read_gpx_segments(f)
+        if format == "tcx": return read_tcx_segments(f)
+        return read_fit_segments(f)
+
+
+def get_start_time(segments):
+    """Return the time of the first point of some track segments, as a naive UTC datetime, or None."""
+    for lon, lat, time in segments:
+        if len(time) > 0 and not np.isnat(time[0]): return time[0].astype(object)
+    return None
+
+
+def write_gpx(segments, file_path):
+    """
+    Write track segments as a GPX file, with a single track.
+
+    Parameters:
+    - segments: The list of (lon, lat, time) tuples of arrays. The points with a NaT time have no time element.
+    - file_path: The output GPX file path.
+    """
+    with open(file_path, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write('<gpx xmlns="http://www.topografix.com/GPX/1/1" version="1.1" creator="GeoLogMap">\n<trk>\n')
+        for lon, lat, time in segments:
+            times = np.datetime_as_string(time, unit='s')
+            f.write('<trkseg>\n')
+            f.writelines('<trkpt lat="{}" lon="{}">{}</trkpt>\n'.format(la, lo, "" if t == "NaT" else "<time>" + t + "Z</time>") for lo, la, t in zip(lon.tolist(), lat.tolist(), times))
+            f.write('</trkseg>\n')
+        f.write('</trk>\n</gpx>\n')
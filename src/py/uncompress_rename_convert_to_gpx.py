@@ -2,10 +2,15 @@ import os
 import gpxpy
 import gpxpy.gpx
 import pandas as pd
+import numpy as np
 from lxml import etree
-from fitparse import FitFile, FitParseError
+from fitparse import FitParseError
 import shutil
 import gzip
+from multiprocessing import Pool
+from gpx_reader import read_gpx_start_time
+from fit_reader import read_fit_records
+from track_reader import track_format, open_track_file, read_tcx_segments, read_fit_segments, write_gpx
 
 
 def uncompress_gz_files(folder_path):
@@ -28,13 +33,7 @@ def uncompress_gz_files(folder_path):
 
 
 def get_start_time_from_gpx(file_path):
-    with open(file_path, 'r') as gpx_file:
-        gpx = gpxpy.parse(gpx_file)
-        for track in gpx.tracks:
-            for segment in track.segments:
-                if len(segment.points) > 0:
-                    return segment.points[0].time
-    return None
+    return read_gpx_start_time(file_path)
 
 def get_start_time_from_tcx(file_path):
     with open(file_path, 'rb') as tcx_file:
@@ -48,11 +47,9 @@ def get_start_time_from_tcx(file_path):
 
 def get_start_time_from_fit(file_path):
     try:
-        fitfile = FitFile(file_path)
-        for record in fitfile.get_messages('record'):
-            for record_data in record:
-                if record_data.name == 'timestamp' and record_data.value is not None:
-                    return pd.to_datetime(record_data.value)
+        time, lat, lon = read_fit_records(file_path)
+        time = time[~np.isnat(time)]
+        if len(time) > 0: return pd.to_datetime(time[0])
     except FitParseError as e:
         print(f"Error parsing FIT file {file_path}: {e}")
     return None
@@ -106,63 +103,82 @@ def convert_tcx_to_gpx(tcx_file_path):
     return gpx
 
 def convert_fit_to_gpx(fit_file_path):
-    fitfile = FitFile(fit_file_path)
     gpx = gpxpy.gpx.GPX()
     segment = gpxpy.gpx.GPXTrackSegment()
     track = gpxpy.gpx.GPXTrack()
     gpx.tracks.append(track)
     track.segments.append(segment)
 
-    for record in fitfile.get_messages('record'):
-        lat = None
-        lon = None
-        time = None
-        for record_data in record:
-            if record_data.name == 'position_lat' and record_data.value is not None:
-                lat = record_data.value * (180 / 2**31)  # Convert semicircles to degrees
-            elif record_data.name == 'position_long' and record_data.value is not None:
-                lon = record_data.value * (180 / 2**31)  # Convert semicircles to degrees
-            elif record_data.name == 'timestamp' and record_data.value is not None:
-                time = pd.to_datetime(record_data.value)
-
-        if lat is not None and lon is not None and time is not None:
-            point = gpxpy.gpx.GPXTrackPoint(latitude=lat, longitude=lon, time=time)
-            segment.points.append(point)
-    
+    for lon, lat, time in read_fit_segments(fit_file_path):
+        for lo, la, t in zip(lon.tolist(), lat.tolist(), time.tolist()):
+            segment.points.append(gpxpy.gpx.GPXTrackPoint(latitude=la, longitude=lo, time=pd.to_datetime(t)))
+
     return gpx
 
 
-def convert_to_gpx(input_folder, output_folder):
+def _convert_file(task):
+    # convert a file to GPX, decoding it only once. GPX files are copied. Gzipped files are read as streams.
+    (input_file_path, output_folder) = task
+    file = os.path.basename(input_file_path)
+    tmp_file_path = os.path.join(output_folder, "." + file + ".tmp")
+    try:
+        if track_format(file) == "gpx":
+            segments = None
+            with open_track_file(input_file_path) as f: start_time = read_gpx_start_time(f)
+        elif track_format(file) in ["tcx", "fit"]:
+            # the start time is the one of the first track point, even without position
+            read = read_tcx_segments if track_format(file) == "tcx" else read_fit_segments
+            with open_track_file(input_file_path) as f: segments, start_time = read(f, start_time=True)
+        else:
+            return file, None, "Unexpected file format"
+
+        if start_time is None: return file, None, "No track point time"
+
+        # write to a temporary file named after the input file, renamed by the parent process in the input order,
+        # so that the duplicate kept does not depend on the scheduling of the processes
+        new_file_name = start_time.strftime("%Y-%m-%d_%H-%M-%S.gpx")
+        if segments is None:
+            with open_track_file(input_file_path) as f_in, open(tmp_file_path, 'wb') as f_out: shutil.copyfileobj(f_in, f_out)
+        else: write_gpx(segments, tmp_file_path)
+        return file, new_file_name, None
+
+    except Exception as e:
+        if os.path.exists(tmp_file_path): os.remove(tmp_file_path)
+        return file, None, str(e)
+
+
+def convert_to_gpx(input_folder, output_folder, nb_processes = 1):
+    """
+    Convert the GPX, TCX and FIT files of a folder into GPX files named after their start time.
+    Each file is decoded once. Files with the same start time are duplicates: only one of them is kept,
+    the last one in the input file name order, whatever the number of processes.
+    Gzipped files (.gpx.gz, .tcx.gz, .fit.gz) are decompressed while they are read: uncompress_gz_files is not needed,
+    and the input folder is left unchanged.
+
+    Parameters:
+    - input_folder: The input files folder.
+    - output_folder: The output GPX files folder.
+    - nb_processes: The number of processes used to convert the files.
+
+    Returns:
+    - The list of the output file names.
+    """
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
 
-    for file in os.listdir(input_folder):
-        try:
-            input_file_path = os.path.join(input_folder, file)
-            start_time = None
-            gpx = None
-
-            if file.endswith(".gpx"):
-                start_time = get_start_time_from_gpx(input_file_path)
-                with open(input_file_path, 'r') as gpx_file:
-                    gpx = gpxpy.parse(gpx_file)
-            elif file.endswith(".tcx"):
-                start_time = get_start_time_from_tcx(input_file_path)
-                gpx = convert_tcx_to_gpx(input_file_path)
-            elif file.endswith(".fit"):
-                start_time = get_start_time_from_fit(input_file_path)
-                gpx = convert_fit_to_gpx(input_file_path)
-            else:
-                print("Unexpected file format:", file)
-
-            if start_time and gpx:
-                new_file_name = start_time.strftime("%Y-%m-%d_%H-%M-%S.gpx")
-                new_file_path = os.path.join(output_folder, new_file_name)
-                with open(new_file_path, 'w') as new_gpx_file:
-                    new_gpx_file.write(gpx.to_xml())
-                #print(f"Processed {file} and saved as {new_file_name}")
-
-        except Exception as e:
-            print("Error when dealing with file: "+file)
-            print(e)
+    tasks = [(os.path.join(input_folder, file), output_folder) for file in sorted(os.listdir(input_folder))]
+    if nb_processes <= 1: results = list(map(_convert_file, tasks))
+    else:
+        with Pool(nb_processes) as pool:
+            results = pool.map(_convert_file, tasks, chunksize=max(1, len(tasks) // (4*nb_processes)))
 
+    # rename the converted files in the input order: a later duplicate replaces an earlier one
+    new_file_names = []
+    for file, new_file_name, error in results:
+        if error:
+            print("Error when dealing with file: "+file)
+            print(error)
+        else:
+            os.replace(os.path.join(output_folder, "." + file + ".tmp"), os.path.join(output_folder, new_file_name))
+            new_file_names.append(new_file_name)
+    return new_file_names
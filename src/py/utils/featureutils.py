@@ -4,8 +4,25 @@ from shapely.geometry import shape, mapping
 from rtree import index
 
 
+#check if a file is a GeoParquet file, from its extension
+#GeoParquet files are handled by utils.parquetutils, which requires pyarrow
+def is_parquet(file):
+    return str(file).endswith(".parquet")
+
+#check if a file is a trace store folder, handled by utils.tracestoreutils
+def is_trace_store(file):
+    return str(file).rstrip("/").endswith(".traces")
+
+
 #load features from a file, as a list of features - each feature is a simple dictionnary
 def load_features(file, bbox=None, layer=None):
+    if is_parquet(file):
+        from utils.parquetutils import load_features_parquet
+        return load_features_parquet(file, bbox=bbox, layer=layer)
+    if is_trace_store(file):
+        from utils.tracestoreutils import load_features_trace_store
+        return load_features_trace_store(file, bbox=bbox, layer=layer)
+
     features = []
 
     gpkg = fiona.open(file, 'r', bbox=bbox, layer=layer)
@@ -19,6 +36,38 @@ def load_features(file, bbox=None, layer=None):
     return features
 
 
+#iterate over the features of a file - each feature is a simple dictionnary
+#features are read lazily, one by one, so that the whole layer is never in memory
+def iter_features(file, bbox=None, layer=None, where=None, columns=None):
+    """
+    Iterate over the features of a file, as simple dictionnaries.
+
+    Parameters:
+    - file: The file path.
+    - bbox: A (minx, miny, maxx, maxy) bounding box to filter the features.
+    - layer: The layer name.
+    - where: An SQL WHERE clause to filter the features, for example "length_m > 1000".
+    - columns: The list of the properties to read. All properties are read if None.
+    """
+    if is_parquet(file):
+        if where is not None: raise ValueError("SQL where clauses are not supported for GeoParquet files: " + file)
+        from utils.parquetutils import iter_features_parquet
+        yield from iter_features_parquet(file, bbox=bbox, layer=layer, columns=columns)
+        return
+    if is_trace_store(file):
+        if where is not None: raise ValueError("SQL where clauses are not supported for trace stores: " + file)
+        from utils.tracestoreutils import iter_features_trace_store
+        yield from iter_features_trace_store(file, bbox=bbox, layer=layer, columns=columns)
+        return
+
+    with fiona.open(file, 'r', layer=layer, include_fields=columns) as src:
+        for d in src.filter(bbox=bbox, where=where):
+            f = { "geometry": shape(d['geometry']) }
+            properties = d['properties']
+            for key, value in properties.items(): f[key] = value
+            yield f
+
+
 #remove all properties of the feature/dictionnary, except the geometry
 def keep_only_geometry(feature):
     for attribute in list(feature.keys()):
@@ -76,7 +125,7 @@ def get_schema_from_geojson_feature(feature):
 
 
 
-def save_features_to_gpkg(fs, out_gpkg_file, crs_epsg="3035"):
+def save_features_to_gpkg(fs, out_gpkg_file, crs_epsg="3035", layer_suffix=""):
     """
     Save a list of features with mixed geometry types (points, lines, etc.) 
     as a GeoPackage file with separate layers for each geometry type.
@@ -85,6 +134,7 @@ def save_features_to_gpkg(fs, out_gpkg_file, crs_epsg="3035"):
     - fs: List of dictionaries representing the features.
     - out_gpkg_file: The output file path for the GeoPackage.
     - crs_epsg: The EPSG code for the coordinate reference system (default is "3035").
+    - layer_suffix: A suffix to add to the layer names, to store several datasets in a same file.
     """
 
     # index features by geometry type
@@ -116,6 +166,66 @@ def save_features_to_gpkg(fs, out_gpkg_file, crs_epsg="3035"):
         }
 
         # write features to layer
-        with fiona.open(out_gpkg_file, 'w', driver='GPKG', schema=schema, crs = crs, layer = geom_type.lower()) as layer:
+        with fiona.open(out_gpkg_file, 'w', driver='GPKG', schema=schema, crs = crs, layer = geom_type.lower() + layer_suffix) as layer:
             layer.writerecords(features)
 
+
+
+
+
+def save_features_to_gpkg_stream(fs, out_gpkg_file, crs_epsg="3035", schema=None, chunk_size=10000, layer_suffix=""):
+    """
+    Save features with mixed geometry types as a GeoPackage file with separate layers for each geometry type.
+    Features are consumed as a stream and written by chunks, one transaction per chunk, so that they do not have
+    to be all in memory. Layers are created on the fly, when a new geometry type is found. Features are not modified.
+
+    Parameters:
+    - fs: An iterable of dictionaries representing the features, for example a generator.
+    - out_gpkg_file: The output file path for the GeoPackage.
+    - crs_epsg: The EPSG code for the coordinate reference system (default is "3035").
+    - schema: The properties schema, as a dictionnary of property name and type, for example {'identifier': 'str'}.
+      If None, it is derived from the first feature of each geometry type.
+    - chunk_size: The number of features written per transaction.
+    - layer_suffix: A suffix to add to the layer names, to store several datasets in a same file.
+
+    Returns:
+    - The number of saved features.
+    """
+
+    crs = CRS.from_epsg(crs_epsg)
+
+    # features to write, and properties schema, by geometry type
+    buffers = {}
+    schemas = {}
+
+    def flush(geom_type):
+        records = buffers.pop(geom_type)
+        mode = 'a' if geom_type in schemas else 'w'
+        if mode == 'w': schemas[geom_type] = schema if schema is not None else {k: type(v).__name__ for k, v in records[0]["properties"].items()}
+        with fiona.open(out_gpkg_file, mode, driver='GPKG', schema={'geometry': geom_type, 'properties': schemas[geom_type]}, crs = crs, layer = geom_type.lower() + layer_suffix) as layer:
+            layer.writerecords(records)
+
+    nb = 0
+    for feature in fs:
+        geom_type = feature['geometry'].__class__.__name__
+        record = { 'geometry': mapping(feature['geometry']), 'properties': { k: v for k, v in feature.items() if k != 'geometry' } }
+        if geom_type in buffers: buffers[geom_type].append(record)
+        else: buffers[geom_type] = [record]
+        if len(buffers[geom_type]) >= chunk_size: flush(geom_type)
+        nb += 1
+
+    for geom_type in list(buffers.keys()): flush(geom_type)
+    return nb
+
+
+
+def save_features_stream(fs, out_file, crs_epsg="3035", schema=None, chunk_size=10000, layer_suffix=""):
+    """
+    Save features as a GeoPackage file, or as a GeoParquet file if the file extension is '.parquet'.
+    See save_features_to_gpkg_stream. GeoParquet files have a single layer, so layer_suffix cannot be used.
+    """
+    if not is_parquet(out_file):
+        return save_features_to_gpkg_stream(fs, out_file, crs_epsg, schema, chunk_size, layer_suffix)
+    if layer_suffix: raise ValueError("Layers are not supported for GeoParquet files: " + out_file)
+    from utils.parquetutils import save_features_to_parquet_stream
+    return save_features_to_parquet_stream(fs, out_file, crs_epsg, schema, chunk_size)
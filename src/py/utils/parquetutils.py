@@ -0,0 +1,151 @@
+import json
+import numpy as np
+import shapely
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pyproj import CRS
+
+
+# GeoParquet files: a columnar alternative to GeoPackage, to exchange features between processing stages.
+# Geometries are stored as WKB in a 'geometry' column, and properties as typed columns.
+# Files are read in bulk, possibly memory-mapped, directly into shapely geometry arrays.
+
+
+def load_arrays(file, columns=None, memory_map=True):
+    """
+    Load a GeoParquet file as arrays.
+
+    Parameters:
+    - file: The file path.
+    - columns: The list of the properties to read. All properties are read if None.
+    - memory_map: Set to True to memory-map the file.
+
+    Returns:
+    - The shapely geometry array, and a dictionnary of the property arrays.
+    """
+    table = pq.read_table(file, columns=None if columns is None else ["geometry"] + list(columns), memory_map=memory_map)
+    geoms = shapely.from_wkb(table.column("geometry").to_numpy(zero_copy_only=False))
+    properties = { name: table.column(name).to_numpy(zero_copy_only=False) for name in table.column_names if name != "geometry" }
+    return geoms, properties
+
+
+# geometry type names, by shapely type id
+GEOMETRY_TYPES = ["Point", "LineString", "LinearRing", "Polygon", "MultiPoint", "MultiLineString", "MultiPolygon", "GeometryCollection"]
+
+
+def _select(geoms, bbox=None, layer=None):
+    # mask of the geometries with a geometry type and whose bounds intersect a bounding box
+    mask = np.ones(len(geoms), dtype=bool)
+    if layer is not None:
+        layers = [layer] if isinstance(layer, str) else layer
+        mask &= np.isin(shapely.get_type_id(geoms), [i for i, t in enumerate(GEOMETRY_TYPES) if t.lower() in layers])
+    if bbox is not None:
+        b = shapely.bounds(geoms)
+        mask &= (b[:,0] <= bbox[2]) & (b[:,2] >= bbox[0]) & (b[:,1] <= bbox[3]) & (b[:,3] >= bbox[1])
+    return mask
+
+
+def _to_features(geoms, properties, mask):
+    # make feature dictionnaries
+    names = list(properties.keys())
+    values = [properties[name][mask].tolist() for name in names]
+    fs = []
+    for i, geom in enumerate(geoms[mask]):
+        f = { "geometry": geom }
+        for name, vs in zip(names, values): f[name] = vs[i]
+        fs.append(f)
+    return fs
+
+
+def load_features_parquet(file, bbox=None, layer=None, columns=None):
+    """
+    Load features from a GeoParquet file, as a list of simple dictionnaries.
+
+    Parameters:
+    - bbox: A (minx, miny, maxx, maxy) bounding box to filter the features.
+    - layer: A geometry type in lower case, or a list of them, to filter the features - this mimics the GeoPackage layers
+      written by save_features_to_gpkg, one per geometry type.
+    - columns: The list of the properties to read. All properties are read if None.
+    """
+    geoms, properties = load_arrays(file, columns)
+    return _to_features(geoms, properties, _select(geoms, bbox, layer))
+
+
+def iter_features_parquet(file, bbox=None, layer=None, columns=None, batch_size=10000):
+    """
+    Iterate over the features of a GeoParquet file, read by batches. See load_features_parquet.
+    """
+    pf = pq.ParquetFile(file, memory_map=True)
+    for batch in pf.iter_batches(batch_size=batch_size, columns=None if columns is None else ["geometry"] + list(columns)):
+        geoms = shapely.from_wkb(batch.column("geometry").to_numpy(zero_copy_only=False))
+        properties = { name: batch.column(name).to_numpy(zero_copy_only=False) for name in batch.schema.names if name != "geometry" }
+        yield from _to_features(geoms, properties, _select(geoms, bbox, layer))
+
+
+def get_bounds_parquet(file, layers=None):
+    """Return the bounds of the features of a GeoParquet file, possibly restricted to some geometry types."""
+    geoms, _ = load_arrays(file, columns=[])
+    return tuple(shapely.total_bounds(geoms[_select(geoms, layer=layers)]))
+
+
+def _geo_metadata(crs_epsg, geometry_types):
+    # GeoParquet metadata
+    return json.dumps({
+        "version": "1.0.0",
+        "primary_column": "geometry",
+        "columns": { "geometry": { "encoding": "WKB", "geometry_types": sorted(geometry_types), "crs": CRS.from_epsg(int(crs_epsg)).to_json_dict() } }
+    })
+
+
+def save_features_to_parquet_stream(fs, out_file, crs_epsg="3035", schema=None, chunk_size=10000):
+    """
+    Save features as a GeoParquet file. Features are consumed as a stream and written by chunks, one row group per chunk.
+    Features are not modified.
+
+    Parameters:
+    - fs: An iterable of dictionaries representing the features, for example a generator.
+    - out_file: The output file path.
+    - crs_epsg: The EPSG code for the coordinate reference system (default is "3035").
+    - schema: The properties schema, as a dictionnary of property name and type ('str', 'int', 'float' or 'bool').
+      If None, it is derived from the first feature.
+    - chunk_size: The number of features per row group.
+
+    Returns:
+    - The number of saved features.
+    """
+
+    types = { 'str': pa.string(), 'int': pa.int64(), 'float': pa.float64(), 'bool': pa.bool_() }
+    writer = None
+    arrow_schema = None
+    geometry_types = set()
+
+    def write(chunk):
+        nonlocal writer, arrow_schema
+        if arrow_schema is None:
+            props = schema if schema is not None else { k: type(v).__name__ for k, v in chunk[0].items() if k != 'geometry' }
+            arrow_schema = pa.schema([("geometry", pa.binary())] + [(k, types[t]) for k, t in props.items()])
+        geoms = np.array([f['geometry'] for f in chunk], dtype=object)
+        geometry_types.update(shapely.get_type_id(geoms).tolist())
+        columns = [pa.array(shapely.to_wkb(geoms), pa.binary())] + [pa.array([f.get(field.name) for f in chunk], field.type) for field in list(arrow_schema)[1:]]
+        table = pa.Table.from_arrays(columns, schema=arrow_schema)
+        if writer is None: writer = pq.ParquetWriter(out_file, arrow_schema)
+        writer.write_table(table)
+
+    nb = 0
+    chunk = []
+    for f in fs:
+        chunk.append(f)
+        nb += 1
+        if len(chunk) == chunk_size:
+            write(chunk)
+            chunk = []
+    if chunk: write(chunk)
+
+    # empty file
+    if writer is None:
+        writer = pq.ParquetWriter(out_file, pa.schema([("geometry", pa.binary())] + [(k, types[t]) for k, t in (schema or {}).items()]))
+
+    # add the GeoParquet metadata
+    writer.add_key_value_metadata({ "geo": _geo_metadata(crs_epsg, [GEOMETRY_TYPES[t] for t in geometry_types if t >= 0]) })
+    writer.close()
+    return nb
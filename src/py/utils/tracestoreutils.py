@@ -0,0 +1,159 @@
+import os
+import json
+import numpy as np
+import shapely
+
+
+# Trace store: all traces in a few flat binary arrays, in a folder, as an alternative to a GeoPackage of linestrings.
+# The arrays are memory-mapped when the store is opened: opening is instantaneous, pages are loaded by the
+# operating system when they are used, and they are shared between the processes reading the same store.
+#
+#   coords.npy     the (x, y) coordinates of the points of all traces, one after the other.
+#                  float64, or int32 when quantised: the coordinates are then the integer values times the quantisation step.
+#   times.npy      the point times, as datetime64[s] values in UTC.
+#   offsets.npy    the index of the first point of each trace, followed by the total number of points (int64).
+#   attributes.npy the trace attributes, as a numpy structured array with one record per trace.
+#   metadata.json  the CRS EPSG code, the quantisation step, and the numbers of traces and points.
+#
+# Trace store folders are named with a '.traces' extension.
+
+ATTRIBUTES_DTYPE = np.dtype([
+    ("identifier", "U64"),
+    ("length_m", "<i8"),
+    ("duration_s", "<i8"),
+    ("speed_kmh", "<i8"),
+    ("start_time", "U19"),
+    ("end_time", "U19")
+])
+
+
+def write_trace_store(traces, store_folder, epsg="3857", quantisation=None):
+    """
+    Write traces as a trace store.
+
+    Parameters:
+    - traces: An iterable of (xy, time, attributes) tuples, where xy is the (n,2) array of the projected coordinates,
+      time the array of the n point times, and attributes a dictionnary with the ATTRIBUTES_DTYPE fields.
+    - store_folder: The store folder. It is created if needed, and its files are overwritten.
+    - epsg: The EPSG code of the coordinates.
+    - quantisation: The quantisation step, in CRS units. If specified, coordinates are stored as int32 values,
+      which halves the store size. The step must be large enough for the coordinates to fit within int32.
+
+    Returns:
+    - The number of traces written.
+    """
+    coords, times, counts, attributes = [], [], [], []
+    for xy, time, att in traces:
+        coords.append(np.asarray(xy, dtype=float))
+        times.append(np.asarray(time, dtype='datetime64[s]'))
+        counts.append(len(xy))
+        attributes.append(tuple(att[name] for name in ATTRIBUTES_DTYPE.names))
+
+    coords = np.concatenate(coords) if coords else np.zeros((0, 2))
+    if quantisation is not None:
+        q = np.round(coords / quantisation)
+        if len(q) > 0 and np.abs(q).max() > np.iinfo(np.int32).max: raise ValueError("Quantisation step too small for int32 coordinates: " + str(quantisation))
+        coords = q.astype(np.int32)
+
+    os.makedirs(store_folder, exist_ok=True)
+    np.save(os.path.join(store_folder, "coords.npy"), coords)
+    np.save(os.path.join(store_folder, "times.npy"), np.concatenate(times) if times else np.zeros(0, dtype='datetime64[s]'))
+    np.save(os.path.join(store_folder, "offsets.npy"), np.concatenate(([0], np.cumsum(counts, dtype=np.int64))).astype(np.int64))
+    np.save(os.path.join(store_folder, "attributes.npy"), np.array(attributes, dtype=ATTRIBUTES_DTYPE))
+    with open(os.path.join(store_folder, "metadata.json"), 'w') as f:
+        json.dump({ "epsg": epsg, "quantisation": quantisation, "nb_traces": len(counts), "nb_points": len(coords) }, f, indent=3)
+    return len(counts)
+
+
+
+class TraceStore:
+    """A trace store opened for reading. Arrays are memory-mapped. See write_trace_store."""
+
+    def __init__(self, store_folder):
+        with open(os.path.join(store_folder, "metadata.json")) as f:
+            metadata = json.load(f)
+        self.epsg = metadata["epsg"]
+        self.quantisation = metadata["quantisation"]
+        self.raw_coords = np.load(os.path.join(store_folder, "coords.npy"), mmap_mode='r')
+        self.times = np.load(os.path.join(store_folder, "times.npy"), mmap_mode='r')
+        self.offsets = np.load(os.path.join(store_folder, "offsets.npy"), mmap_mode='r')
+        self.attributes = np.load(os.path.join(store_folder, "attributes.npy"), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def _points(self, ids):
+        # indices of the points of some traces, and the trace index of each point
+        starts = self.offsets[ids]
+        counts = self.offsets[ids + 1] - starts
+        trace = np.repeat(np.arange(len(ids)), counts)
+        return np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum()), trace
+
+    def coordinates(self, i=None):
+        """Return the (n,2) float64 coordinates of a trace, or of all traces if i is None."""
+        c = self.raw_coords if i is None else self.raw_coords[self.offsets[i]:self.offsets[i+1]]
+        return c * self.quantisation if self.quantisation is not None else np.asarray(c)
+
+    def bounds(self):
+        """Return the bounds of each trace, as a (nb_traces, 4) array."""
+        if len(self) == 0: return np.zeros((0, 4))
+        c = self.coordinates()
+        starts = self.offsets[:-1]
+        return np.column_stack((np.minimum.reduceat(c[:,0], starts), np.minimum.reduceat(c[:,1], starts), np.maximum.reduceat(c[:,0], starts), np.maximum.reduceat(c[:,1], starts)))
+
+    def select(self, bbox=None):
+        """Return the indices of the traces whose bounds intersect a (minx, miny, maxx, maxy) bounding box, or of all traces."""
+        if bbox is None: return np.arange(len(self))
+        b = self.bounds()
+        return np.nonzero((b[:,0] <= bbox[2]) & (b[:,2] >= bbox[0]) & (b[:,1] <= bbox[3]) & (b[:,3] >= bbox[1]))[0]
+
+    def geometries(self, ids=None):
+        """Return the linestrings of some traces, or of all traces, as a shapely array. They are built at once."""
+        if ids is None: ids = np.arange(len(self))
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) == 0: return np.array([], dtype=object)
+        points, trace = self._points(ids)
+        c = self.raw_coords[points]
+        if self.quantisation is not None: c = c * self.quantisation
+        return shapely.linestrings(c, indices=trace)
+
+    def features(self, ids=None, columns=None):
+        """Return the features of some traces, or of all traces, as simple dictionnaries, as the ones of featureutils.load_features."""
+        if ids is None: ids = np.arange(len(self))
+        names = list(ATTRIBUTES_DTYPE.names) if columns is None else list(columns)
+        atts = self.attributes[ids]
+        values = [atts[name].tolist() for name in names]
+        fs = []
+        for i, geom in enumerate(self.geometries(ids)):
+            f = { "geometry": geom }
+            for name, vs in zip(names, values): f[name] = vs[i]
+            fs.append(f)
+        return fs
+
+    def total_bounds(self):
+        """Return the bounds of all traces."""
+        c = self.coordinates()
+        return float(c[:,0].min()), float(c[:,1].min()), float(c[:,0].max()), float(c[:,1].max())
+
+
+def open_trace_store(store_folder):
+    return TraceStore(store_folder)
+
+
+def load_features_trace_store(store_folder, bbox=None, layer=None, columns=None):
+    """
+    Load the traces of a trace store as features, like featureutils.load_features.
+    All traces are linestrings: the 'linestring' layer contains all of them, and the other layers are empty.
+    """
+    if layer is not None and layer != "linestring": return []
+    store = open_trace_store(store_folder)
+    return store.features(store.select(bbox), columns)
+
+
+def iter_features_trace_store(store_folder, bbox=None, layer=None, columns=None, batch_size=10000):
+    """Iterate over the traces of a trace store as features, built by batches. See load_features_trace_store."""
+    if layer is not None and layer != "linestring": return
+    store = open_trace_store(store_folder)
+    ids = store.select(bbox)
+    for i in range(0, len(ids), batch_size):
+        yield from store.features(ids[i:i+batch_size], columns)